@@ -26,6 +26,10 @@ except ImportError as e_pipeline_import:
 
 logger = logging.getLogger(__name__)
 
+# Conjuntos de valores para las comprobaciones de pertenencia que se hacen por cada fichero
+_MONOCHROME_PHOTOMETRICS = frozenset({"MONOCHROME1", "MONOCHROME2"})
+_CLASIFICACIONES_NO_ESCRIBIBLES = frozenset({"BAML_OTRO", "ClasificacionFallida", "Desconocida", "ErrorPixelArrayNulo"})
+
 # --- load_kerma_calibration_data_for_lut, read_and_decompress_dicom, _apply_kerma_lut_to_dataset ---
 # --- Estas funciones permanecen IGUAL que en la última versión funcional ---
 # --- (la que resolvió el error de numpy.uint_ y los NameErrors) ---
@@ -206,7 +210,7 @@ def _apply_kerma_lut_to_dataset(ds: Dataset,
     if 'VOILUTSequence' in ds:
         del ds.VOILUTSequence
         logger.debug(f"[{sop_uid}] VOILUTSequence eliminada.")
-    if ds.PhotometricInterpretation not in ["MONOCHROME1", "MONOCHROME2"]:
+    if ds.PhotometricInterpretation not in _MONOCHROME_PHOTOMETRICS:
         logger.warning(f"[{sop_uid}] PhotometricInterpretation original '{ds.PhotometricInterpretation}'. Cambiando a MONOCHROME2.")
         ds.PhotometricInterpretation = "MONOCHROME2" 
     elif ds.PhotometricInterpretation == "MONOCHROME1": 
@@ -275,7 +279,7 @@ def process_and_prepare_dicom_for_pacs(
 
         if clasificacion_baml_mapeada and \
            not clasificacion_baml_mapeada.startswith("Error") and \
-           clasificacion_baml_mapeada not in ["BAML_OTRO", "ClasificacionFallida", "Desconocida", "ErrorPixelArrayNulo"]:
+           clasificacion_baml_mapeada not in _CLASIFICACIONES_NO_ESCRIBIBLES:
             # clasificacion_baml_mapeada ya es "FDT", "MTF", "BC"
             valor_a_escribir_clasificacion = clasificacion_baml_mapeada
         elif clasificacion_baml_mapeada: 
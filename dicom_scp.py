@@ -1,5 +1,7 @@
 # dicom_scp.py
 import logging
+import os
+import tempfile
 from pathlib import Path
 from pynetdicom import AE, evt, AllStoragePresentationContexts, ALL_TRANSFER_SYNTAXES
 from pynetdicom.sop_class import Verification
@@ -25,6 +27,23 @@ def handle_echo(event):
     logger.info(f"Recibido C-ECHO de {calling_ae}")
     return 0x0000 
 
+def _save_atomically(ds, filepath: Path) -> None:
+    """
+    Guarda el dataset en un temporal del mismo directorio y lo renombra a su nombre final,
+    de modo que los lectores nunca ven un fichero truncado si el SCP se interrumpe.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            ds.save_as(f, enforce_file_format=True)
+        os.replace(tmp_path, filepath) # Atómico dentro del mismo sistema de ficheros
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def start_scp_server(aet: str, port: int, storage_dir: Path):
     """
     Inicia el servidor DICOM C-STORE SCP (Service Class Provider).
@@ -71,8 +90,8 @@ def start_scp_server(aet: str, port: int, storage_dir: Path):
             filename = ds.SOPInstanceUID + ".dcm"
             filepath = storage_dir / filename
             
-            # Guardar el fichero
-            ds.save_as(filepath, enforce_file_format=True)
+            # Guardar el fichero (temporal + rename: nunca queda un .dcm a medio escribir)
+            _save_atomically(ds, filepath)
             
             logger.info(f"Archivo DICOM recibido y guardado: {filepath}")
             return 0x0000 # Éxito
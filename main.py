@@ -1,22 +1,32 @@
 # main.py (VERSIÓN FINAL 3.2 - Corregido el nombre del módulo)
+import asyncio
+import copy
+import functools
 import logging
+import mmap
+import os
+import stat
 import threading
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from typing import Dict, List, Any, Optional, AsyncIterator
+from pathlib import Path
+from typing import Callable, Dict, List, Any, Optional, AsyncIterator, Tuple
 
 import pydicom
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from pydicom.dataset import Dataset as DicomDataset
 from pydicom.tag import Tag
-from pydicom.datadict import tag_for_keyword, keyword_for_tag
+from pydicom.datadict import tag_for_keyword, keyword_for_tag, dictionary_VR
 from pydicom.multival import MultiValue
+from pydicom.pixels import iter_pixels # Decodificación por frames (pydicom >= 3.0)
 
 from config import settings
 import pacs_operations # <--- CORRECCIÓN DE NOMBRE
 import dicom_scp
 from models import (
-    StudyResponse, SeriesResponse, InstanceMetadataResponse, PixelDataResponse
+    StudyResponse, SeriesResponse, InstanceMetadataResponse, PixelDataResponse,
+    as_primitive, header_key, is_valid_uid, TAG_STR_RE # Utilidades compartidas con la API REST
 )
 from mcp_utils import parse_lut_explanation
 
@@ -24,6 +34,117 @@ from mcp_utils import parse_lut_explanation
 logging.basicConfig(level=settings.logging.level, format=settings.logging.format, force=True)
 logger = logging.getLogger(__name__)
 
+# VR de diccionario por tag: se consulta en cada campo pedido, así que se memoriza
+_vr_for_tag = functools.lru_cache(maxsize=4096)(dictionary_VR)
+# Keyword por tag: se consulta en cada filtro, campo y elemento devuelto (también dentro de secuencias)
+_keyword_for_tag = functools.lru_cache(maxsize=4096)(keyword_for_tag)
+
+def _return_keys(keywords: List[str]) -> List[Tuple[Tag, str]]:
+    """Resuelve una lista de keywords a pares (Tag, VR) para añadirlos con add_new."""
+    return [(tag, _vr_for_tag(tag)) for tag in (Tag(tag_for_keyword(kw)) for kw in keywords)]
+
+# Campos de retorno de las consultas, resueltos una vez al importar (sin setattr por petición)
+_STUDY_RETURN_KEYS = _return_keys(["StudyInstanceUID", "PatientID", "PatientName", "StudyDate", "StudyDescription", "ModalitiesInStudy", "AccessionNumber"])
+_SERIES_RETURN_KEYS = _return_keys(["SeriesInstanceUID", "Modality", "SeriesNumber", "SeriesDescription", "KVP"])
+
+# Campos de cada modelo de respuesta: se rellenan sin pasar por la validación de Pydantic
+_STUDY_FIELDS = tuple(StudyResponse.model_fields)
+_SERIES_FIELDS = tuple(SeriesResponse.model_fields)
+
+def _fields_from_dataset(ds: DicomDataset, fields: Tuple[str, ...]) -> Dict[str, Any]:
+    """Equivale a Model.model_validate(ds, from_attributes=True).model_dump() sin validar."""
+    get = ds.get
+    return {name: as_primitive(get(name)) for name in fields}
+
+def _instance_dict_from_dataset(res_ds: DicomDataset, requested_tags: Tuple[Tag, ...]) -> Dict[str, Any]:
+    """Mismo dict que InstanceMetadataResponse(...).model_dump(), sin validar; sin tags pedidos se vuelcan todos."""
+    headers: Dict[str, Any] = {}
+    if requested_tags: # Los tags pedidos pueden no haber vuelto del PACS: una sola búsqueda con get
+        elements = (element for element in map(res_ds.get, requested_tags) if element is not None)
+    else: # Todos los elementos en una sola pasada, sin comprobaciones de pertenencia
+        elements = iter(res_ds)
+    for element in elements:
+        headers[header_key(element.tag)] = _VR_HANDLERS.get(element.VR, _conv_value)(element.value)
+    return {
+        "SOPInstanceUID": as_primitive(res_ds.get("SOPInstanceUID", "")),
+        "InstanceNumber": str(res_ds.get("InstanceNumber", "")),
+        "dicom_headers": headers
+    }
+
+@functools.lru_cache(maxsize=1024)
+def _resolve_tag(key: str) -> Tag:
+    """Resuelve una keyword o un tag "(gggg,eeee)" a Tag; lanza ValueError si no es válido."""
+    if ',' in key:
+        match = TAG_STR_RE.match(key)
+        if not match:
+            raise ValueError(f"Formato de tag inválido: '{key}'")
+        return Tag(int(match.group(1), 16), int(match.group(2), 16))
+    tag_value = tag_for_keyword(key)
+    if tag_value is None:
+        raise ValueError(f"Keyword DICOM desconocida: '{key}'")
+    return Tag(tag_value)
+
+# Apertura de ficheros recibidos: O_NOFOLLOW rechaza enlaces simbólicos (no existe en Windows)
+_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0) | getattr(os, "O_CLOEXEC", 0) | getattr(os, "O_BINARY", 0)
+
+# Tags del módulo Image Pixel que deben acompañar a PixelData
+_ROWS_TAG = Tag(0x0028, 0x0010)
+_COLUMNS_TAG = Tag(0x0028, 0x0011)
+# Únicos tags de cabecera que necesita la herramienta de píxeles (el resto se salta al leer)
+_IMAGE_HEADER_TAGS = [
+    _ROWS_TAG, _COLUMNS_TAG,
+    Tag(0x0028, 0x0002), # SamplesPerPixel
+    Tag(0x0028, 0x0008), # NumberOfFrames
+    Tag(0x0028, 0x0100), # BitsAllocated
+    Tag(0x0028, 0x0103), # PixelRepresentation
+]
+
+# LUTExplanation (0028,3003): se compara en cada elemento de las secuencias, así que se construye una sola vez
+_LUT_EXPLANATION_TAG = Tag(0x0028, 0x3003)
+
+def _sequence_item_to_dict(item_dataset: DicomDataset) -> Dict[str, Any]:
+    """Convierte un item de secuencia en diccionario; LUTExplanation se devuelve parseado."""
+    item_dict: Dict[str, Any] = {}
+    for item_element in item_dataset:
+        key = header_key(item_element.tag)
+        if item_element.tag == _LUT_EXPLANATION_TAG:
+            item_dict[key] = parse_lut_explanation(item_element.value).model_dump()
+        else:
+            value = item_element.value
+            item_dict[key] = str(value) if value is not None else None
+    return item_dict
+
+def _apply_additional_filters(identifier: DicomDataset, filters: Optional[Dict[str, str]], ctx: str) -> None:
+    """Añade al identificador C-FIND los filtros adicionales (keyword o "(gggg,eeee)" -> valor)."""
+    if not filters:
+        return
+    for key, value in filters.items():
+        try:
+            tag = _resolve_tag(str(key))
+            try: vr = _vr_for_tag(tag)
+            except KeyError: vr = None # Tag privado o desconocido
+            if vr: identifier.add_new(tag, vr, value) # Evita la resolución keyword->tag->VR de setattr
+            else: identifier[tag] = value
+        except Exception:
+            logger.warning(f"No se pudo procesar el filtro de {ctx} '{key}'. Es probable que no sea un tag DICOM válido.")
+
+def _conv_value(value: Any) -> Any:
+    """Conversión por defecto de un valor DICOM: str, o lista de str si es multivaluado."""
+    if isinstance(value, MultiValue):
+        return list(map(str, value))
+    if isinstance(value, str): # Ya es texto, sin llamar a str()
+        return value
+    return str(value) if value is not None else ""
+
+def _conv_sq(sequence: Any) -> List[Dict[str, Any]]:
+    """Convierte los items de una secuencia (SQ) en diccionarios."""
+    return [_sequence_item_to_dict(item_dataset) for item_dataset in sequence]
+
+# Conversores por VR para los dicom_headers; los VRs sin entrada usan _conv_value
+_VR_HANDLERS: Dict[str, Callable[[Any], Any]] = {
+    'SQ': _conv_sq,
+}
+
 # --- Contexto y Ciclo de Vida ---
 @dataclass
 class DicomToolContext:
@@ -75,76 +196,62 @@ mcp = FastAPI(
     title="Servidor de Herramientas DICOM para Agentes de IA",
     version="3.2.0",
     description="Una API que expone operaciones DICOM como herramientas para ser consumidas por agentes inteligentes.",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse # Serialización JSON rápida (listas de instancias con dicom_headers)
 )
 
 
 # --- Definición de Herramientas ---
 
-@mcp.post("/tools/query_studies", response_model=List[StudyResponse], summary="Busca estudios en el PACS.")
+@mcp.post("/tools/query_studies", responses={200: {"model": List[StudyResponse]}}, summary="Busca estudios en el PACS.")
 async def query_studies(
     request: Request, patient_id: Optional[str] = None, study_date: Optional[str] = None,
     accession_number: Optional[str] = None, patient_name: Optional[str] = None,
     additional_filters: Optional[Dict[str, str]] = None
-) -> List[Dict[str, Any]]:
+) -> ORJSONResponse:
     """Realiza una consulta C-FIND a nivel de ESTUDIO en el PACS."""
     identifier = DicomDataset()
     identifier.QueryRetrieveLevel = "STUDY"
-    for kw in ["StudyInstanceUID", "PatientID", "PatientName", "StudyDate", "StudyDescription", "ModalitiesInStudy", "AccessionNumber"]:
-        setattr(identifier, kw, "")
+    for tag, vr in _STUDY_RETURN_KEYS:
+        identifier.add_new(tag, vr, "")
 
     if patient_id: identifier.PatientID = patient_id
     if study_date: identifier.StudyDate = study_date
     if accession_number: identifier.AccessionNumber = accession_number
     if patient_name: identifier.PatientName = patient_name
     
-    if additional_filters:
-        for key, value in additional_filters.items():
-            try:
-                tag = Tag(key) if ',' in str(key) else Tag(tag_for_keyword(str(key)))
-                keyword = keyword_for_tag(tag)
-                if keyword: setattr(identifier, keyword, value)
-                else: identifier[tag] = value
-            except Exception:
-                logger.warning(f"No se pudo procesar el filtro de estudio '{key}'. Es probable que no sea un tag DICOM válido.")
-
-    logger.info(f"Ejecutando query_studies con el identificador:\n{identifier}")
+    _apply_additional_filters(identifier, additional_filters, "estudio")
+
+    logger.debug("Ejecutando query_studies con el identificador:\n%s", identifier) # str(identifier) solo si DEBUG está activo
     pacs_config = request.state.dicom_context.pacs_config
     results = await pacs_operations.perform_c_find_async(identifier, pacs_config, query_model_uid='S')
-    return [StudyResponse.model_validate(ds, from_attributes=True).model_dump() for ds in results]
+    # ORJSONResponse directa: ni response_model ni la anotación de retorno vuelven a validar cada fila
+    return ORJSONResponse([_fields_from_dataset(ds, _STUDY_FIELDS) for ds in results])
 
 
-@mcp.post("/tools/query_series", response_model=List[SeriesResponse], summary="Busca series dentro de un estudio.")
+@mcp.post("/tools/query_series", responses={200: {"model": List[SeriesResponse]}}, summary="Busca series dentro de un estudio.")
 async def query_series(
     request: Request, study_instance_uid: str, additional_filters: Optional[Dict[str, str]] = None
-) -> List[Dict[str, Any]]:
+) -> ORJSONResponse:
     """Busca series dentro de un estudio."""
     identifier = DicomDataset()
     identifier.QueryRetrieveLevel = "SERIES"
     identifier.StudyInstanceUID = study_instance_uid
-    for kw in ["SeriesInstanceUID", "Modality", "SeriesNumber", "SeriesDescription", "KVP"]:
-        setattr(identifier, kw, "")
+    for tag, vr in _SERIES_RETURN_KEYS:
+        identifier.add_new(tag, vr, "")
 
-    if additional_filters:
-        for key, value in additional_filters.items():
-            try:
-                tag = Tag(key) if ',' in str(key) else Tag(tag_for_keyword(str(key)))
-                keyword = keyword_for_tag(tag)
-                if keyword: setattr(identifier, keyword, value)
-                else: identifier[tag] = value
-            except Exception:
-                logger.warning(f"No se pudo procesar el filtro de serie '{key}'. Es probable que no sea un tag DICOM válido.")
+    _apply_additional_filters(identifier, additional_filters, "serie")
                 
-    logger.info(f"Ejecutando query_series con el identificador:\n{identifier}")
+    logger.debug("Ejecutando query_series con el identificador:\n%s", identifier) # str(identifier) solo si DEBUG está activo
     pacs_config = request.state.dicom_context.pacs_config
     results = await pacs_operations.perform_c_find_async(identifier, pacs_config, query_model_uid='S')
-    return [SeriesResponse.model_validate(ds, from_attributes=True).model_dump() for ds in results]
+    return ORJSONResponse([_fields_from_dataset(ds, _SERIES_FIELDS) for ds in results])
 
 
-@mcp.post("/tools/query_instances", response_model=List[InstanceMetadataResponse], summary="Busca metadatos de instancias en una serie.")
+@mcp.post("/tools/query_instances", responses={200: {"model": List[InstanceMetadataResponse]}}, summary="Busca metadatos de instancias en una serie.")
 async def query_instances(
     request: Request, study_instance_uid: str, series_instance_uid: str, fields_to_retrieve: Optional[List[str]] = None
-) -> List[Dict[str, Any]]:
+) -> ORJSONResponse:
     """Busca metadatos de instancias en una serie."""
     identifier = DicomDataset()
     identifier.QueryRetrieveLevel = "IMAGE"
@@ -155,43 +262,23 @@ async def query_instances(
 
     requested_tags_for_response: Dict[str, Tag] = {}
     if fields_to_retrieve:
+        present_tags = set(identifier.keys())
         for field_str in set(fields_to_retrieve):
             try:
-                tag_from_field = Tag(tag_for_keyword(field_str)) if ',' not in field_str else Tag(field_str)
+                tag_from_field = _resolve_tag(field_str)
                 requested_tags_for_response[str(tag_from_field)] = tag_from_field
-                keyword = keyword_for_tag(tag_from_field)
-                if keyword and not hasattr(identifier, keyword):
-                    setattr(identifier, keyword, "")
+                if tag_from_field not in present_tags and _keyword_for_tag(tag_from_field):
+                    identifier.add_new(tag_from_field, _vr_for_tag(tag_from_field), "")
+                    present_tags.add(tag_from_field)
             except Exception as e:
                 logger.warning(f"No se pudo procesar el campo a recuperar '{field_str}': {e}")
 
-    logger.info(f"Ejecutando query_instances con el identificador:\n{identifier}")
+    logger.debug("Ejecutando query_instances con el identificador:\n%s", identifier) # str(identifier) solo si DEBUG está activo
     pacs_config = request.state.dicom_context.pacs_config
     results = await pacs_operations.perform_c_find_async(identifier, pacs_config, query_model_uid='S')
     
-    response_list: List[Dict] = []
-    for res_ds in results:
-        headers: Dict[str, Any] = {}
-        tags_to_populate = requested_tags_for_response or {str(elem.tag): elem.tag for elem in res_ds}
-        for tag_obj in tags_to_populate.values():
-            if tag_obj in res_ds:
-                element = res_ds[tag_obj]
-                key_to_use = element.keyword or str(element.tag)
-                if element.VR == 'SQ':
-                    value_to_store = [
-                        {(item_element.keyword or str(item_element.tag)): (parse_lut_explanation(item_element.value).model_dump() if item_element.tag == Tag(0x0028,0x3003) else (str(item_element.value) if item_element.value is not None else None)) for item_element in item_dataset}
-                        for item_dataset in element.value
-                    ]
-                elif isinstance(element.value, MultiValue): value_to_store = [str(v) for v in element.value]
-                else: value_to_store = str(element.value) if element.value is not None else ""
-                headers[key_to_use] = value_to_store
-        
-        response_list.append(InstanceMetadataResponse(
-            SOPInstanceUID=res_ds.get("SOPInstanceUID", ""),
-            InstanceNumber=str(res_ds.get("InstanceNumber", "")),
-            dicom_headers=headers
-        ).model_dump())
-    return response_list
+    requested_tags = tuple(requested_tags_for_response.values())
+    return ORJSONResponse([_instance_dict_from_dataset(res_ds, requested_tags) for res_ds in results])
 
 
 @mcp.post("/tools/move_dicom_entity_to_local_server", summary="Mueve un estudio, serie o instancia al servidor local.")
@@ -229,49 +316,98 @@ async def move_dicom_entity_to_local_server(
     return {"status": "UNKNOWN", "message": "No se recibió una respuesta de estado final del PACS."}
 
 
+def _read_local_pixel_data(filepath: Path, sop_instance_uid: str, with_preview: bool = True) -> Dict[str, Any]:
+    """
+    Lee cabecera y frame 0 de un fichero local y construye la respuesta (bloqueante: se ejecuta en un hilo).
+
+    Con with_preview=False solo se lee la cabecera: forma y tipo se deducen de sus tags.
+    Las peticiones repetidas sobre el mismo fichero sin cambios se sirven de caché.
+    """
+    try:
+        st = os.stat(filepath, follow_symlinks=False)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Archivo DICOM no encontrado localmente en {filepath}")
+    # Copia profunda: la respuesta contiene listas (forma, vista previa 5x5) que de otro modo
+    # seguirían compartidas con la entrada de la caché; el coste es mínimo con estos tamaños
+    return copy.deepcopy(_cached_local_pixel_data(str(filepath), sop_instance_uid, with_preview, st.st_mtime_ns, st.st_size))
+
+# Clave (ruta, uid, preview, mtime_ns, tamaño): si el SCP sobrescribe el fichero cambian
+# su mtime/tamaño y la entrada antigua deja de usarse. Solo se cachea la respuesta (con
+# una esquina 5x5 como mucho), nunca el Dataset ni el array de píxeles.
+@functools.lru_cache(maxsize=64)
+def _cached_local_pixel_data(filepath: str, sop_instance_uid: str, with_preview: bool, mtime_ns: int, size: int) -> Dict[str, Any]:
+    """Lee el fichero y construye la respuesta de _read_local_pixel_data (mtime_ns y size solo forman parte de la clave)."""
+    # Apertura sin seguir enlaces simbólicos (el stat de la clave tampoco los sigue)
+    try:
+        fd = os.open(filepath, _OPEN_FLAGS)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Archivo DICOM no encontrado localmente en {filepath}")
+    except OSError as e:
+        logger.warning(f"No se pudo abrir el archivo DICOM local {filepath}: {e}")
+        raise HTTPException(status_code=400, detail="El archivo solicitado no es un archivo DICOM regular.")
+    if not stat.S_ISREG(os.fstat(fd).st_mode): # p. ej. un directorio con ese nombre
+        os.close(fd)
+        raise HTTPException(status_code=400, detail="El archivo solicitado no es un archivo DICOM regular.")
+    # Un único mapeo de solo lectura para cabecera y frame 0: el SO pagina solo lo que se toca
+    with os.fdopen(fd, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        ds = pydicom.dcmread(mm, force=True, stop_before_pixels=True, specific_tags=_IMAGE_HEADER_TAGS)
+        # Sin Rows/Columns no hay módulo Image Pixel: 404 sin intentar decodificar
+        if _ROWS_TAG not in ds or _COLUMNS_TAG not in ds:
+            raise HTTPException(status_code=404, detail="El objeto DICOM no contiene datos de píxeles.")
+        samples_per_pixel = int(ds.get("SamplesPerPixel", 1))
+        number_of_frames = int(ds.get("NumberOfFrames", 1) or 1)
+        if not with_preview:
+            # Convención de pydicom: (frames, filas, cols, samples), sin los ejes de tamaño 1
+            header_shape = ((number_of_frames,) if number_of_frames > 1 else ()) + (ds.Rows, ds.Columns) + ((samples_per_pixel,) if samples_per_pixel > 1 else ())
+            bits_allocated = int(ds.get("BitsAllocated", 16))
+            dtype = f"{'u' if int(ds.get('PixelRepresentation', 0)) == 0 else ''}int{8 if bits_allocated <= 8 else bits_allocated}"
+            return PixelDataResponse(
+                sop_instance_uid=sop_instance_uid, rows=ds.Rows, columns=ds.Columns,
+                pixel_array_shape=list(header_shape), pixel_array_dtype=dtype,
+                pixel_array_preview=None, message="Pixel metadata read from the locally stored file header. No preview requested."
+            ).model_dump()
+        mm.seek(0)
+        try:
+            frame_array = next(iter_pixels(mm, indices=[0]))
+        except AttributeError:
+            raise HTTPException(status_code=404, detail="El objeto DICOM no contiene datos de píxeles.")
+
+    # Forma del array completo según la convención de pydicom, deducida de la cabecera
+    pixel_array_shape = frame_array.shape if number_of_frames == 1 else (number_of_frames, *frame_array.shape)
+    logger.info(f"Frame 0 obtenido del archivo {filepath}: forma={pixel_array_shape}, tipo={frame_array.dtype}")
+    
+    preview = None
+    if frame_array.ndim >= 2 and frame_array.size > 0:
+        rows_preview = min(frame_array.shape[0], 5)
+        cols_preview = min(frame_array.shape[1], 5)
+        if frame_array.ndim == 2:  # Monocromo (primer frame si es multiframe)
+            preview = frame_array[:rows_preview, :cols_preview].tolist()
+        elif samples_per_pixel > 1 and frame_array.shape[-1] == samples_per_pixel:
+            # Color (filas, cols, samples): preview del primer canal (ej. Rojo)
+            preview = frame_array[:rows_preview, :cols_preview, 0].tolist()
+    
+    return PixelDataResponse(
+        sop_instance_uid=sop_instance_uid, rows=ds.Rows, columns=ds.Columns,
+        pixel_array_shape=list(pixel_array_shape), pixel_array_dtype=str(frame_array.dtype),
+        pixel_array_preview=preview, message="Pixel data accessed from locally stored file."
+    ).model_dump()
+
+
 @mcp.post("/tools/get_local_instance_pixel_data", response_model=PixelDataResponse, summary="Obtiene datos de píxeles de una instancia ya recibida.")
 async def get_local_instance_pixel_data(
-    request: Request, sop_instance_uid: str
+    request: Request, sop_instance_uid: str, preview: bool = True
 ) -> Dict[str, Any]:
-    """Recupera metadatos de píxeles de un archivo DICOM almacenado localmente."""
+    """Recupera metadatos de píxeles de un archivo DICOM almacenado localmente (preview=False: sin decodificar píxeles)."""
+    # El UID forma parte de la ruta: se rechaza cualquier cosa que no sea un UID DICOM (evita '..', '/')
+    if not is_valid_uid(sop_instance_uid):
+        raise HTTPException(status_code=400, detail="SOPInstanceUID con formato inválido.")
     filepath = settings.gateway.local_scp.storage_dir / (sop_instance_uid + ".dcm")
-    if not filepath.is_file():
-        raise HTTPException(status_code=404, detail=f"Archivo DICOM no encontrado localmente en {filepath}")
     
     try:
-        ds = pydicom.dcmread(str(filepath), force=True)
-        if not hasattr(ds, 'PixelData') or ds.PixelData is None:
-             raise HTTPException(status_code=404, detail="El objeto DICOM no contiene datos de píxeles.")
-        
-        pixel_array = ds.pixel_array
-        logger.info(f"Array de píxeles obtenido del archivo {filepath}: forma={pixel_array.shape}, tipo={pixel_array.dtype}")
-        
-        # --- LÓGICA DE PREVIEW RESTAURADA Y COMPLETA ---
-        preview = None
-        if pixel_array.ndim >= 2 and pixel_array.size > 0:
-            if pixel_array.ndim == 2:  # Imagen 2D (monocromo)
-                rows_preview = min(pixel_array.shape[0], 5)
-                cols_preview = min(pixel_array.shape[1], 5)
-                preview = pixel_array[:rows_preview, :cols_preview].tolist()
-            elif pixel_array.ndim == 3:  # Imagen 3D (multiframe o color)
-                # Si es monocromo multiframe (ej. (frames, filas, cols))
-                if ds.get("SamplesPerPixel", 1) == 1:
-                    rows_preview = min(pixel_array.shape[1], 5)
-                    cols_preview = min(pixel_array.shape[2], 5)
-                    # Preview del primer frame
-                    preview = pixel_array[0, :rows_preview, :cols_preview].tolist()
-                # Si es color (ej. (filas, cols, samples))
-                elif ds.get("SamplesPerPixel", 1) > 1 and pixel_array.shape[-1] == ds.SamplesPerPixel:
-                    rows_preview = min(pixel_array.shape[0], 5)
-                    cols_preview = min(pixel_array.shape[1], 5)
-                    # Preview del primer canal (ej. Rojo)
-                    preview = pixel_array[:rows_preview, :cols_preview, 0].tolist()
-        
-        return PixelDataResponse(
-            sop_instance_uid=sop_instance_uid, rows=ds.Rows, columns=ds.Columns,
-            pixel_array_shape=list(pixel_array.shape), pixel_array_dtype=str(pixel_array.dtype),
-            pixel_array_preview=preview, message="Pixel data accessed from locally stored file."
-        ).model_dump()
+        # Lectura y decodificación fuera del event loop para no bloquear otras herramientas
+        return await asyncio.to_thread(_read_local_pixel_data, filepath, sop_instance_uid, preview)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error procesando el archivo DICOM local {filepath}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error interno procesando el archivo: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error interno procesando el archivo: {e}")
@@ -1,6 +1,7 @@
 # main_mcp_pure.py
 import logging
 import json
+import mmap
 import threading
 import atexit
 from typing import Dict, Optional, List, Any
@@ -26,6 +27,7 @@ from pydicom.dataset import Dataset as DicomDataset
 from pydicom.tag import Tag
 from pydicom.datadict import tag_for_keyword, keyword_for_tag
 from pydicom.multival import MultiValue
+from pydicom.pixels import pixel_array # Decodifica un único frame (pydicom >= 3.0)
 
 # --- 1. Configuración del Logger y Contexto ---
 logging.basicConfig(level=settings.logging.level, format=settings.logging.format, force=True)
@@ -326,27 +328,35 @@ async def get_local_instance_pixel_data(sop_instance_uid: str) -> str:
         return json.dumps({"error": f"Archivo DICOM no encontrado localmente en {filepath}"})
     
     try:
-        ds = pydicom.dcmread(str(filepath), force=True)
-        if not hasattr(ds, 'PixelData') or ds.PixelData is None:
-             return json.dumps({"error": "El objeto DICOM no contiene datos de píxeles."})
-        
-        pixel_array = ds.pixel_array
+        # Un mapeo de solo lectura para cabecera y frame 0: la cabecera se lee sin PixelData
+        # y solo se decodifica el primer frame, que es todo lo que necesita la vista previa
+        with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ds = pydicom.dcmread(mm, force=True, stop_before_pixels=True)
+            if "Rows" not in ds or "Columns" not in ds:
+                return json.dumps({"error": "El objeto DICOM no contiene datos de píxeles."})
+            mm.seek(0)
+            try:
+                frame_array = pixel_array(mm, index=0)
+            except AttributeError: # Sin PixelData
+                return json.dumps({"error": "El objeto DICOM no contiene datos de píxeles."})
+
+        samples_per_pixel = int(ds.get("SamplesPerPixel", 1))
+        number_of_frames = int(ds.get("NumberOfFrames", 1) or 1)
+        # Forma del array completo según la convención de pydicom, deducida de la cabecera
+        pixel_array_shape = frame_array.shape if number_of_frames == 1 else (number_of_frames, *frame_array.shape)
+
         preview = None
-        if pixel_array.ndim >= 2 and pixel_array.size > 0:
-            if pixel_array.ndim == 2:
-                rows_preview, cols_preview = min(pixel_array.shape[0], 5), min(pixel_array.shape[1], 5)
-                preview = pixel_array[:rows_preview, :cols_preview].tolist()
-            elif pixel_array.ndim == 3:
-                if ds.get("SamplesPerPixel", 1) == 1:
-                    rows_preview, cols_preview = min(pixel_array.shape[1], 5), min(pixel_array.shape[2], 5)
-                    preview = pixel_array[0, :rows_preview, :cols_preview].tolist()
-                elif ds.get("SamplesPerPixel", 1) > 1 and pixel_array.shape[-1] == ds.SamplesPerPixel:
-                    rows_preview, cols_preview = min(pixel_array.shape[0], 5), min(pixel_array.shape[1], 5)
-                    preview = pixel_array[:rows_preview, :cols_preview, 0].tolist()
+        if frame_array.ndim >= 2 and frame_array.size > 0:
+            rows_preview, cols_preview = min(frame_array.shape[0], 5), min(frame_array.shape[1], 5)
+            if frame_array.ndim == 2: # Monocromo (primer frame si es multiframe)
+                preview = frame_array[:rows_preview, :cols_preview].tolist()
+            elif samples_per_pixel > 1 and frame_array.shape[-1] == samples_per_pixel:
+                # Color (filas, cols, samples): preview del primer canal
+                preview = frame_array[:rows_preview, :cols_preview, 0].tolist()
         
         response = PixelDataResponse(
             sop_instance_uid=sop_instance_uid, rows=ds.Rows, columns=ds.Columns,
-            pixel_array_shape=pixel_array.shape, pixel_array_dtype=str(pixel_array.dtype),
+            pixel_array_shape=pixel_array_shape, pixel_array_dtype=str(frame_array.dtype),
             pixel_array_preview=preview, message="Pixel data accessed from local file."
         )
         return response.model_dump_json(indent=2)
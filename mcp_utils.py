@@ -1,6 +1,6 @@
 # utils.py (o el contenido que debe quedar en api_main.py)
 
-import re
+import functools
 import logging
 from typing import Optional, Tuple, Any
 from models import LUTExplanationModel # Asegúrate de que models.py tiene esta clase
@@ -20,15 +20,14 @@ def _parse_range_to_floats(range_str: Optional[str]) -> Optional[Tuple[float, fl
     """
     if not range_str: return None
     try:
-        parts = range_str.strip().split('-')
-        if len(parts) == 1:
-            val = float(parts[0].strip())
+        start_str, sep, end_str = range_str.partition('-') # float() ya ignora los espacios alrededor
+        if not sep:
+            val = float(start_str)
             return (val, val)
-        elif len(parts) == 2:
-            return (float(parts[0].strip()), float(parts[1].strip()))
-        else:
+        if '-' in end_str:
             logger.warning(f"Formato de rango inesperado: '{range_str}'.")
             return None
+        return (float(start_str), float(end_str))
     except ValueError:
         logger.warning(f"Error al convertir valores del rango '{range_str}' a flotantes.")
         return None
@@ -48,29 +47,29 @@ def parse_lut_explanation(explanation_str_raw: Optional[Any]) -> LUTExplanationM
     """
     if explanation_str_raw is None:
         return LUTExplanationModel(FullText=None)
-    
-    text = str(explanation_str_raw)
-    explanation_part = text
+    return _parse_lut_explanation_str(str(explanation_str_raw))
+
+# Las explicaciones de LUT se repiten en todas las instancias de una serie: se cachea el
+# resultado por texto. Los consumidores no deben modificar el modelo devuelto.
+@functools.lru_cache(maxsize=2048)
+def _parse_lut_explanation_str(text: str) -> LUTExplanationModel:
+    """Parsea el texto de un LUTExplanation ya convertido a str (ver parse_lut_explanation)."""
+    # Formato fijo "<texto> [InCalibRange: a-b] [OutLUTRange: c-d]": basta con localizar
+    # las dos etiquetas literales y cortar, sin pasar por el motor de expresiones regulares.
+    stripped = text.strip()
+    in_idx = stripped.find("InCalibRange:")
+    out_idx = stripped.find("OutLUTRange:")
     in_calib_range_parsed: Optional[Tuple[float, float]] = None
     out_lut_range_parsed: Optional[Tuple[float, float]] = None
-    
-    # Expresión regular mejorada para capturar los rangos
-    regex_pattern = r"^(.*?)(?:InCalibRange:\s*([0-9\.\-]+))?\s*(?:OutLUTRange:\s*([0-9\.\-]+))?$"
-    match = re.fullmatch(regex_pattern, text.strip())
-    
-    if match:
-        explanation_part = match.group(1).strip() if match.group(1) else ""
-        in_calib_range_str = match.group(2)
-        out_lut_range_str = match.group(3)
-        
-        if in_calib_range_str:
-            in_calib_range_parsed = _parse_range_to_floats(in_calib_range_str.strip())
-        if out_lut_range_str:
-            out_lut_range_parsed = _parse_range_to_floats(out_lut_range_str.strip())
-            
-    else: 
-        logger.debug(f"Regex principal no coincidió para LUTExplanation: '{text}'.")
-        explanation_part = text
+
+    explanation_end = min((idx for idx in (in_idx, out_idx) if idx >= 0), default=len(stripped))
+    explanation_part = stripped[:explanation_end].strip()
+    if in_idx >= 0:
+        in_end = out_idx if out_idx > in_idx else len(stripped)
+        in_calib_range_parsed = _parse_range_to_floats(stripped[in_idx + len("InCalibRange:"):in_end].strip())
+    if out_idx >= 0:
+        out_end = in_idx if in_idx > out_idx else len(stripped)
+        out_lut_range_parsed = _parse_range_to_floats(stripped[out_idx + len("OutLUTRange:"):out_end].strip())
 
     return LUTExplanationModel(
         FullText=text,
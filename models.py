@@ -1,6 +1,44 @@
 # models.py (VERSIÓN FINAL, CORREGIDA Y PERFECCIONADA 4.2)
+import functools
+import re
+from dataclasses import dataclass
 from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List, Dict, Any, Tuple
+from pydicom.datadict import keyword_for_tag
+from pydicom.tag import Tag
+
+# --- UTILIDADES COMPARTIDAS POR LA API REST Y EL SERVIDOR MCP ---
+
+# Tipos que DicomResponseBase deja intactos; el resto (PersonName, MultiValue, IS, DS, UID...) pasa a str
+PRIMITIVE_TYPES = frozenset({str, int, float, list, dict, tuple, type(None)})
+
+def as_primitive(value: Any) -> Any:
+    """Conversión de DicomResponseBase: los tipos de pydicom pasan a str, los básicos se mantienen.
+
+    Se usa también para construir respuestas sin validar (model_construct o dicts).
+    """
+    return value if type(value) in PRIMITIVE_TYPES else str(value)
+
+@functools.lru_cache(maxsize=4096)
+def header_key(tag: Tag) -> str:
+    """Clave JSON de un tag: su keyword, o "(gggg,eeee)" si es privado o desconocido.
+
+    Al estar cacheada, todas las cabeceras de todas las respuestas comparten el
+    mismo objeto str para cada tag, en lugar de una copia por instancia.
+    """
+    return keyword_for_tag(tag) or str(tag)
+
+# Tag en formato "(gggg,eeee)" (paréntesis y espacios opcionales)
+TAG_STR_RE = re.compile(r"\A\s*\(?\s*([0-9A-Fa-f]{1,4})\s*,\s*([0-9A-Fa-f]{1,4})\s*\)?\s*\Z")
+
+# UIDs DICOM: solo dígitos y puntos, máx. 64 caracteres según PS3.5
+_UID_CHARS = b"0123456789."
+_UID_MAX_LEN = 64
+
+def is_valid_uid(uid: str) -> bool:
+    """Comprueba que un UID tenga entre 1 y 64 caracteres, todos dígitos o puntos."""
+    # bytes.translate elimina los caracteres válidos en C: si queda algo, el UID no es válido
+    return 0 < len(uid) <= _UID_MAX_LEN and uid.isascii() and not uid.encode("ascii").translate(None, _UID_CHARS)
 
 # --- MODELO BASE CON VALIDADOR UNIVERSAL Y ROBUSTO ---
 class DicomResponseBase(BaseModel):
@@ -12,18 +50,9 @@ class DicomResponseBase(BaseModel):
     @field_validator('*', mode='before')
     @classmethod
     def convert_non_primitive_types_to_str(cls, v: Any) -> Any:
-        # --- LÓGICA CORREGIDA ---
-        # Define un conjunto con los tipos básicos exactos que no queremos tocar.
-        base_types = {str, int, float, list, dict, tuple, type(None)}
-        
-        # Comprueba si el TIPO EXACTO del valor no está en nuestra lista de tipos base.
-        if type(v) not in base_types:
-            # Si es un tipo especial de pydicom (IS, DS, PN, UID, etc.),
-            # lo convertimos a un string puro para Pydantic.
-            return str(v)
-        
-        # Si ya es un tipo básico, lo devolvemos sin cambios.
-        return v
+        # Si es un tipo especial de pydicom (IS, DS, PN, UID, etc.) se convierte a un
+        # string puro para Pydantic; los tipos básicos exactos se devuelven sin cambios.
+        return as_primitive(v)
 
     class Config:
         from_attributes = True
@@ -71,6 +100,11 @@ class PixelDataResponse(BaseModel):
     pixel_array_shape: Tuple[int, ...]
     pixel_array_dtype: str
     pixel_array_preview: Optional[List[List[Any]]] = None
+    # La misma vista previa como buffer crudo (C-contiguo, dtype = pixel_array_dtype) en base64,
+    # en lugar de pixel_array_preview cuando se pide con ?preview_buffer=true.
+    # Cliente: np.frombuffer(base64.b64decode(b64), dtype=dtype).reshape(shape)
+    preview_buffer_b64: Optional[str] = None
+    preview_buffer_shape: Optional[Tuple[int, ...]] = None
     message: Optional[str] = None
 
 class MoveRequest(BaseModel):
@@ -84,4 +118,26 @@ class MoveRequestItem(BaseModel):
     sop_instance_uid: str
 
 class BulkMoveRequest(BaseModel):
-    instances_to_move: List[MoveRequestItem]
\ No newline at end of file
+    instances_to_move: List[MoveRequestItem]
+
+class BatchSeriesRequest(BaseModel):
+    study_instance_uids: List[str]
+
+class BatchSeriesResponse(BaseModel):
+    # Series por StudyInstanceUID de las consultas que tuvieron éxito
+    series: Dict[str, List[SeriesResponse]]
+    # Mensaje de error por StudyInstanceUID de las consultas que fallaron
+    errors: Dict[str, str] = Field(default_factory=dict)
+
+# Resultado por instancia del C-MOVE masivo. Se crea uno por instancia en lotes que
+# pueden ser grandes: dataclass con __slots__ (sin __dict__ por objeto) en vez de un dict.
+@dataclass(slots=True)
+class CMoveInstanceResult:
+    study_instance_uid: str
+    series_instance_uid: str
+    sop_instance_uid: str
+    status_code_hex: str = "N/A"
+    message: str = "No procesado"
+    sub_operations_completed: int = 0
+    sub_operations_failed: int = 0
+    sub_operations_warning: int = 0
@@ -1,11 +1,13 @@
 # pacs_operations.py
 import asyncio
+import concurrent.futures
 import logging
 import os 
+import threading
 from pydicom.dataset import Dataset 
 from pathlib import Path
 import functools
-from typing import Dict, List, Any, Optional, Dict, Tuple 
+from typing import AsyncIterator, Dict, List, Any, Optional, Dict, Tuple, Union 
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +43,9 @@ from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian, generate
 
 # --- INICIO DE LA SECCIÓN CORREGIDA ---
 
+# Máximo de datasets pendientes de enviar en iter_c_find_async antes de frenar al hilo productor
+_STREAM_QUEUE_MAXSIZE = 64
+
 # Define la función helper que se ejecutará en el hilo para C-FIND
 def _execute_c_find_and_convert_to_list(current_assoc, id_dataset, model_uid_str):
     """
@@ -58,10 +63,10 @@ def _execute_c_find_and_convert_to_list(current_assoc, id_dataset, model_uid_str
         Una lista de tuplas (status, identifier) que son el resultado de la
         operación C-FIND.
     """
-    print(f"[_execute_c_find_and_convert_to_list] Ejecutando assoc.send_c_find con model_uid: {model_uid_str}") # DEBUG
+    logger.debug("[_execute_c_find_and_convert_to_list] Ejecutando assoc.send_c_find con model_uid: %s", model_uid_str)
     responses_generator = current_assoc.send_c_find(id_dataset, model_uid_str)
     result_list = list(responses_generator)
-    print(f"[_execute_c_find_and_convert_to_list] C-FIND completado, {len(result_list)} respuestas recibidas en total (status, identifier pairs).") # DEBUG
+    logger.debug("[_execute_c_find_and_convert_to_list] C-FIND completado, %d respuestas recibidas en total (status, identifier pairs).", len(result_list))
     return result_list
 
 async def perform_c_find_async(identifier: Dataset, pacs_config: dict, query_model_uid: str) -> list:
@@ -80,7 +85,7 @@ async def perform_c_find_async(identifier: Dataset, pacs_config: dict, query_mod
     Returns:
         Una lista de datasets de pydicom que coinciden con la consulta.
     """
-    print("[perform_c_find_async] Iniciando...") # DEBUG
+    logger.debug("[perform_c_find_async] Iniciando...")
     ae = AE(ae_title=pacs_config["AE_TITLE"]) 
     actual_query_model_sop_class_uid = ""
 
@@ -91,11 +96,11 @@ async def perform_c_find_async(identifier: Dataset, pacs_config: dict, query_mod
         ae.add_requested_context(PatientRootQueryRetrieveInformationModelFind) 
         actual_query_model_sop_class_uid = PatientRootQueryRetrieveInformationModelFind 
     else:
-        print(f"[perform_c_find_async] Error: Query model UID '{query_model_uid}' no reconocido.")
+        logger.error("[perform_c_find_async] Error: Query model UID '%s' no reconocido.", query_model_uid)
         return []
 
-    print(f"[perform_c_find_async] AE Title local: {pacs_config['AE_TITLE']}") # DEBUG
-    print(f"[perform_c_find_async] Conectando a PACS: IP={pacs_config['PACS_IP']}, Puerto={pacs_config['PACS_PORT']}, AET={pacs_config['PACS_AET']}") # DEBUG
+    logger.debug("[perform_c_find_async] AE Title local: %s", pacs_config['AE_TITLE'])
+    logger.debug("[perform_c_find_async] Conectando a PACS: IP=%s, Puerto=%s, AET=%s", pacs_config['PACS_IP'], pacs_config['PACS_PORT'], pacs_config['PACS_AET'])
 
     assoc = await asyncio.to_thread(
         ae.associate,
@@ -106,13 +111,14 @@ async def perform_c_find_async(identifier: Dataset, pacs_config: dict, query_mod
 
     results = []
     if assoc.is_established:
-        print("[perform_c_find_async] Asociación establecida.") # DEBUG
+        logger.debug("[perform_c_find_async] Asociación establecida.")
         try:
-            print(f"[perform_c_find_async] Dataset Identificador para C-FIND:\n{identifier}") # DEBUG
-            print(f"[perform_c_find_async] SOP Class UID del modelo de consulta: {actual_query_model_sop_class_uid}") # DEBUG
+            # %s: str(identifier) recorre todo el dataset y solo se evalúa si DEBUG está activo
+            logger.debug("[perform_c_find_async] Dataset Identificador para C-FIND:\n%s", identifier)
+            logger.debug("[perform_c_find_async] SOP Class UID del modelo de consulta: %s", actual_query_model_sop_class_uid)
 
             if not actual_query_model_sop_class_uid:
-                print("[perform_c_find_async] Error: No se pudo determinar la SOP Class UID del modelo de consulta (está vacía).") # DEBUG
+                logger.error("[perform_c_find_async] Error: No se pudo determinar la SOP Class UID del modelo de consulta (está vacía).")
             else:
                 # LLAMADA CORREGIDA a asyncio.to_thread usando la función helper
                 responses = await asyncio.to_thread(
@@ -121,35 +127,219 @@ async def perform_c_find_async(identifier: Dataset, pacs_config: dict, query_mod
                     identifier,                          # Segundo argumento para la helper
                     actual_query_model_sop_class_uid     # Tercer argumento para la helper
                 )
-                print(f"[perform_c_find_async] 'responses' (lista de tuplas status, identifier) recibido de la operación C-FIND (longitud): {len(responses) if responses is not None else 'None'}") # DEBUG
+                logger.debug("[perform_c_find_async] 'responses' (lista de tuplas status, identifier) recibido de la operación C-FIND (longitud): %s", len(responses) if responses is not None else 'None')
 
                 for (status, result_identifier_ds) in responses: 
-                    print(f"[perform_c_find_async] Procesando respuesta C-FIND con estado: {status}") # DEBUG
                     if status and status.Status in (0xFF00, 0xFF01): # Pending 
                         if result_identifier_ds:
-                            print(f"[perform_c_find_async] Identificador de resultado pendiente: {result_identifier_ds.get('PatientID', 'N/A')}, {result_identifier_ds.get('StudyInstanceUID', 'N/A')}") # DEBUG
                             results.append(result_identifier_ds)
                     elif status and status.Status == 0x0000: # Success 
-                        print("[perform_c_find_async] Respuesta C-FIND final: Éxito (normalmente sin datos adicionales aquí).") # DEBUG
+                        logger.debug("[perform_c_find_async] Respuesta C-FIND final: Éxito.")
                     else: # Other statuses like Failure, Cancel, etc.
                         status_val = status.Status if status else 'N/A'
-                        print(f"[perform_c_find_async] Respuesta C-FIND con estado no manejado o de error: {status_val}") # DEBUG
+                        logger.warning("[perform_c_find_async] Respuesta C-FIND con estado no manejado o de error: %s", status_val)
 
         except Exception as e:
-            print(f"[perform_c_find_async] Excepción durante C-FIND o procesamiento de respuesta: {e}") # DEBUG
             logger.error(f"Excepción en perform_c_find_async: {e}", exc_info=True) # Logueo formal
             raise # Re-lanzar para que FastAPI devuelva un 500 y veas el error
         finally:
-            print("[perform_c_find_async] Liberando asociación.") # DEBUG
+            logger.debug("[perform_c_find_async] Liberando asociación.")
             await asyncio.to_thread(assoc.release) 
     else:
-        print("[perform_c_find_async] Asociación NO establecida.") # DEBUG
+        logger.warning("[perform_c_find_async] Asociación NO establecida.")
         # Considera lanzar una excepción aquí para errores de conexión
         # raise ConnectionError("No se pudo establecer la asociación con el PACS.")
 
-    print(f"[perform_c_find_async] Devolviendo {len(results)} resultados.") # DEBUG
+    logger.debug("[perform_c_find_async] Devolviendo %d resultados.", len(results))
     return results
 
+def _execute_c_find_batch(current_assoc, id_datasets, model_uid_str):
+    """
+    Ejecuta varias operaciones C-FIND síncronas sobre una misma asociación.
+
+    Pensada para ejecutarse en un hilo con `asyncio.to_thread`. Las consultas se
+    envían una tras otra reutilizando la asociación, de modo que el coste de
+    establecerla se paga una sola vez.
+
+    Args:
+        current_assoc: La asociación pynetdicom ya establecida.
+        id_datasets: Lista de datasets identificadores para las consultas C-FIND.
+        model_uid_str: El UID del modelo de consulta (ej. Study Root).
+
+    Returns:
+        Una lista con un elemento por identificador, en el mismo orden que `id_datasets`:
+        la lista de datasets resultado (respuestas Pending) o la excepción que hizo
+        fallar esa consulta. Si la asociación se pierde, los identificadores restantes
+        se marcan con un ConnectionError sin intentar enviarlos.
+    """
+    batch_results: List[Any] = []
+    for id_dataset in id_datasets:
+        if not current_assoc.is_established:
+            batch_results.append(ConnectionError("La asociación C-FIND con el PACS se cerró antes de esta consulta."))
+            continue
+        matches = []
+        try:
+            for status, result_identifier_ds in current_assoc.send_c_find(id_dataset, model_uid_str):
+                if status and status.Status in (0xFF00, 0xFF01) and result_identifier_ds:
+                    matches.append(result_identifier_ds)
+                elif status and status.Status != 0x0000:
+                    logger.warning(f"[_execute_c_find_batch] Respuesta C-FIND con estado no manejado o de error: 0x{status.Status:04X}")
+                elif not status:
+                    logger.warning("[_execute_c_find_batch] C-FIND sin dataset de estado (asociación abortada o timeout).")
+        except Exception as e:
+            logger.error(f"[_execute_c_find_batch] Error en C-FIND: {e}", exc_info=True)
+            batch_results.append(e)
+            continue
+        batch_results.append(matches)
+    return batch_results
+
+async def perform_c_find_batch_async(identifiers: List[Dataset], pacs_config: dict, query_model_uid: str) -> List[Union[List[Dataset], Exception]]:
+    """
+    Realiza varias operaciones DICOM C-FIND de forma asíncrona sobre una única asociación.
+
+    Equivalente a llamar a `perform_c_find_async` una vez por identificador, pero
+    amortiza el establecimiento de la asociación con el PACS entre todas las consultas.
+
+    Args:
+        identifiers: Lista de datasets de pydicom con los criterios de búsqueda.
+        pacs_config: Un diccionario con la configuración del PACS (IP, puerto, AETs).
+        query_model_uid: El modelo de consulta a usar ('S' para Study Root,
+                         'P' para Patient Root).
+
+    Returns:
+        Una lista con los datasets coincidentes para cada identificador, o la
+        excepción de las consultas que fallaron, en el mismo orden en que se
+        recibieron (ver `_execute_c_find_batch`).
+
+    Raises:
+        ValueError: Si el modelo de consulta no está soportado.
+        ConnectionError: Si no se puede establecer la asociación con el PACS.
+    """
+    if not identifiers:
+        return []
+
+    if query_model_uid.upper() == 'S':
+        model_sop_class = StudyRootQueryRetrieveInformationModelFind
+    elif query_model_uid.upper() == 'P':
+        model_sop_class = PatientRootQueryRetrieveInformationModelFind
+    else:
+        raise ValueError(f"Modelo de consulta UID '{query_model_uid}' no soportado para C-FIND.")
+
+    ae = AE(ae_title=pacs_config["AE_TITLE"])
+    ae.add_requested_context(model_sop_class)
+
+    assoc = await asyncio.to_thread(
+        ae.associate,
+        pacs_config["PACS_IP"],
+        pacs_config["PACS_PORT"],
+        ae_title=pacs_config["PACS_AET"]
+    )
+    if not assoc.is_established:
+        raise ConnectionError("No se pudo establecer la asociación C-FIND con el PACS.")
+
+    logger.info(f"Asociación establecida para {len(identifiers)} consultas C-FIND en lote.")
+    try:
+        return await asyncio.to_thread(_execute_c_find_batch, assoc, identifiers, model_sop_class)
+    finally:
+        await asyncio.to_thread(assoc.release)
+
+async def iter_c_find_async(identifier: Dataset, pacs_config: dict, query_model_uid: str) -> AsyncIterator[Dataset]:
+    """
+    Realiza una operación DICOM C-FIND y entrega los resultados a medida que llegan.
+
+    A diferencia de `perform_c_find_async`, no espera a la respuesta final del PACS:
+    un hilo consume las respuestas de pynetdicom y las pasa al bucle de eventos por
+    una cola, de modo que el consumidor puede procesar (o enviar) cada dataset en
+    cuanto se recibe.
+
+    Args:
+        identifier: El dataset de pydicom que contiene los criterios de búsqueda.
+        pacs_config: Un diccionario con la configuración del PACS (IP, puerto, AETs).
+        query_model_uid: El modelo de consulta a usar ('S' para Study Root,
+                         'P' para Patient Root).
+
+    Yields:
+        Cada dataset coincidente (respuestas Pending), en orden de llegada.
+
+    Raises:
+        ValueError: Si el modelo de consulta no está soportado.
+        ConnectionError: Si no se puede establecer la asociación con el PACS.
+    """
+    if query_model_uid.upper() == 'S':
+        model_sop_class = StudyRootQueryRetrieveInformationModelFind
+    elif query_model_uid.upper() == 'P':
+        model_sop_class = PatientRootQueryRetrieveInformationModelFind
+    else:
+        raise ValueError(f"Modelo de consulta UID '{query_model_uid}' no soportado para C-FIND.")
+
+    ae = AE(ae_title=pacs_config["AE_TITLE"])
+    ae.add_requested_context(model_sop_class)
+
+    assoc = await asyncio.to_thread(
+        ae.associate,
+        pacs_config["PACS_IP"],
+        pacs_config["PACS_PORT"],
+        ae_title=pacs_config["PACS_AET"]
+    )
+    if not assoc.is_established:
+        raise ConnectionError("No se pudo establecer la asociación C-FIND con el PACS.")
+
+    loop = asyncio.get_running_loop()
+    # Cola acotada: si el cliente HTTP lee despacio, el hilo productor se bloquea en lugar
+    # de acumular en memoria el resultado completo del C-FIND
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_STREAM_QUEUE_MAXSIZE)
+    stop = threading.Event() # El consumidor dejó de iterar: el productor no debe seguir encolando
+    done = object() # Centinela de fin de respuestas
+
+    def _put(item: Any) -> bool:
+        """Encola un elemento esperando a que haya hueco; devuelve False si se pidió parar."""
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    def _produce() -> None:
+        try:
+            for status, result_identifier_ds in assoc.send_c_find(identifier, model_sop_class):
+                if status and status.Status in (0xFF00, 0xFF01) and result_identifier_ds:
+                    if not _put(result_identifier_ds):
+                        return
+                elif status and status.Status != 0x0000:
+                    logger.warning(f"[iter_c_find_async] Respuesta C-FIND con estado no manejado o de error: 0x{status.Status:04X}")
+                elif not status:
+                    logger.warning("[iter_c_find_async] C-FIND sin dataset de estado (asociación abortada o timeout).")
+        except Exception as e:
+            if not _put(e):
+                return
+        _put(done)
+
+    producer = asyncio.ensure_future(asyncio.to_thread(_produce))
+    finished = False # Solo True si se recibió el centinela: el PACS terminó la consulta
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                finished = True
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if finished:
+            await producer
+            await asyncio.to_thread(assoc.release)
+        else:
+            # El consumidor dejó de iterar (p. ej. el cliente cerró la conexión) o hubo un
+            # error: se aborta la consulta y se espera a que el hilo productor termine
+            stop.set()
+            await asyncio.to_thread(assoc.abort)
+            await asyncio.gather(producer, return_exceptions=True)
+
 # --- FIN DE LA SECCIÓN CORREGIDA ---
 
 def _create_ae_with_contexts(client_aet_title: str, dicom_dataset: Optional[pydicom.Dataset] = None) -> AE:
@@ -224,18 +414,16 @@ async def perform_c_move_async(
     pacs_aet = pacs_config.get("PACS_AET", "DCM4CHEE")
 
     logger.info(f"Iniciando C-MOVE hacia {move_destination_aet}...")
-    print(f"[perform_c_move_async] Iniciando C-MOVE...")
-    print(f"[perform_c_move_async] AE Title local: {ae_title}")
-    print(f"[perform_c_move_async] Conectando a PACS: IP={pacs_ip}, Puerto={pacs_port}, AET={pacs_aet}")
-    print(f"[perform_c_move_async] Destino del MOVE: {move_destination_aet}")
-    print(f"[perform_c_move_async] Dataset Identificador para C-MOVE:\n{identifier}")
+    logger.debug("[perform_c_move_async] AE Title local: %s", ae_title)
+    logger.debug("[perform_c_move_async] Conectando a PACS: IP=%s, Puerto=%s, AET=%s", pacs_ip, pacs_port, pacs_aet)
+    logger.debug("[perform_c_move_async] Dataset Identificador para C-MOVE:\n%s", identifier)
 
     if query_model_uid == 'S':
         model_sop_class = StudyRootQueryRetrieveInformationModelMove
     else:
         raise ValueError(f"Modelo de consulta UID '{query_model_uid}' no soportado para C-MOVE.")
     
-    print(f"[perform_c_move_async] SOP Class UID del modelo de consulta: {model_sop_class}")
+    logger.debug("[perform_c_move_async] SOP Class UID del modelo de consulta: %s", model_sop_class)
 
     ae = AE(ae_title=ae_title)
     ae.add_requested_context(model_sop_class)
@@ -251,7 +439,7 @@ async def perform_c_move_async(
 
     results = []
     if assoc.is_established:
-        print("[perform_c_move_async] Asociación establecida para C-MOVE.")
+        logger.debug("[perform_c_move_async] Asociación establecida para C-MOVE.")
         
         # Ejecutar send_c_move en un hilo separado
         responses_generator = await loop.run_in_executor(
@@ -265,22 +453,103 @@ async def perform_c_move_async(
         for status_ds, returned_identifier_ds in responses_generator:
             results.append((status_ds, returned_identifier_ds))
             if status_ds:
-                print(f"[perform_c_move_async] Respuesta C-MOVE Status: 0x{status_ds.Status:04X}")
-                if 'NumberOfRemainingSuboperations' in status_ds:
-                    print(f"  Restantes: {status_ds.NumberOfRemainingSuboperations}, "
-                          f"Completadas: {status_ds.NumberOfCompletedSuboperations}, "
-                          f"Fallidas: {status_ds.NumberOfFailedSuboperations}, "
-                          f"Advertencias: {status_ds.NumberOfWarningSuboperations}")
+                logger.debug("[perform_c_move_async] Respuesta C-MOVE Status: 0x%04X", status_ds.Status)
         
-        print("[perform_c_move_async] Liberando asociación C-MOVE.")
+        logger.debug("[perform_c_move_async] Liberando asociación C-MOVE.")
         await loop.run_in_executor(None, assoc.release)
     else:
-        print("[perform_c_move_async] Fallo al establecer asociación C-MOVE.")
         raise ConnectionError("No se pudo establecer la asociación C-MOVE con el PACS.")
     
-    print(f"[perform_c_move_async] Operación C-MOVE completada, devolviendo {len(results)} respuestas de estado.")
+    logger.debug("[perform_c_move_async] Operación C-MOVE completada, devolviendo %d respuestas de estado.", len(results))
     return results
 
+def _execute_c_move_batch(current_assoc, id_datasets, move_destination_aet, model_sop_class):
+    """
+    Ejecuta varias operaciones C-MOVE síncronas sobre una misma asociación.
+
+    Pensada para ejecutarse en un hilo con `asyncio.to_thread`, de modo que tanto
+    el envío como la lectura de las respuestas no bloqueen el bucle de eventos.
+
+    Args:
+        current_assoc: La asociación pynetdicom ya establecida.
+        id_datasets: Lista de datasets identificadores para las operaciones C-MOVE.
+        move_destination_aet: El AE Title del destino del C-MOVE.
+        model_sop_class: La SOP Class del modelo de consulta/recuperación.
+
+    Returns:
+        Una lista con un elemento por identificador, en el mismo orden que `id_datasets`:
+        la lista de respuestas (status, identifier) de su C-MOVE, o la excepción que lo
+        hizo fallar. Un fallo no descarta los resultados de los C-MOVE anteriores y, si
+        la asociación se pierde, los identificadores restantes se marcan con un
+        ConnectionError sin intentar enviarlos.
+    """
+    batch_results: List[Any] = []
+    for id_dataset in id_datasets:
+        if not current_assoc.is_established:
+            batch_results.append(ConnectionError("La asociación C-MOVE con el PACS se cerró antes de esta operación."))
+            continue
+        try:
+            batch_results.append(list(current_assoc.send_c_move(id_dataset, move_destination_aet, model_sop_class)))
+        except Exception as e:
+            logger.error(f"[_execute_c_move_batch] Error en C-MOVE de {id_dataset.get('SOPInstanceUID', 'N/A')}: {e}", exc_info=True)
+            batch_results.append(e)
+    return batch_results
+
+async def perform_c_move_batch_async(
+    identifiers: List[DicomDataset],
+    pacs_config: Dict[str, Any],
+    move_destination_aet: str,
+    query_model_uid: str
+) -> List[Union[List[Tuple[DicomDataset, Optional[DicomDataset]]], Exception]]:
+    """
+    Realiza varias operaciones DICOM C-MOVE de forma asíncrona sobre una única asociación.
+
+    Equivalente a llamar a `perform_c_move_async` una vez por identificador, pero
+    amortiza la conexión TCP y la negociación de la asociación entre todas las
+    operaciones.
+
+    Args:
+        identifiers: Lista de datasets de pydicom con los UIDs a mover.
+        pacs_config: Diccionario con la configuración del PACS.
+        move_destination_aet: El AE Title del destino del C-MOVE.
+        query_model_uid: El modelo de consulta a usar ('S' para Study Root).
+
+    Returns:
+        Una lista con las respuestas (status, identifier) de cada C-MOVE, o la
+        excepción de los que fallaron, en el mismo orden en que se recibieron los
+        identificadores (ver `_execute_c_move_batch`).
+
+    Raises:
+        ConnectionError: Si no se puede establecer la asociación con el PACS.
+    """
+    if not identifiers:
+        return []
+
+    if query_model_uid == 'S':
+        model_sop_class = StudyRootQueryRetrieveInformationModelMove
+    else:
+        raise ValueError(f"Modelo de consulta UID '{query_model_uid}' no soportado para C-MOVE.")
+
+    ae = AE(ae_title=pacs_config.get("AE_TITLE", "PYNETDICOM"))
+    ae.add_requested_context(model_sop_class)
+
+    assoc = await asyncio.to_thread(
+        ae.associate,
+        pacs_config.get("PACS_IP", "127.0.0.1"),
+        pacs_config.get("PACS_PORT", 11112),
+        ae_title=pacs_config.get("PACS_AET", "DCM4CHEE")
+    )
+    if not assoc.is_established:
+        raise ConnectionError("No se pudo establecer la asociación C-MOVE con el PACS.")
+
+    logger.info(f"Asociación establecida para {len(identifiers)} operaciones C-MOVE en lote hacia {move_destination_aet}.")
+    try:
+        return await asyncio.to_thread(
+            _execute_c_move_batch, assoc, identifiers, move_destination_aet, model_sop_class
+        )
+    finally:
+        await asyncio.to_thread(assoc.release)
+
 def _perform_pacs_send_sync(
     ae_instance: AE,
     filepath_str: str, # filepath_str es el que se pasa a send_c_store
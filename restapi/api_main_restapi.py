@@ -1,14 +1,28 @@
 # api_main.py
+import asyncio
+import base64
+from decimal import Decimal
+import functools
+from collections import defaultdict, deque
+import hashlib # ETag del favicon
 import logging
 import re 
 import io
+import mmap
 import os
-import json # Para parsear filtros JSON
-from fastapi import FastAPI, HTTPException, Query
+import stat
+from pathlib import Path
+import orjson # Para parsear filtros JSON (más rápido que json)
+import numpy as np
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse # Serialización JSON rápida de las respuestas
 from fastapi_mcp import FastApiMCP
-from starlette.responses import FileResponse # Para favicon
-from typing import Any, List, Optional, Dict, Tuple, Union # Añadido Union
+from pydantic import ValidationError
+from typing import Any, Callable, Deque, List, Mapping, Optional, Dict, Sequence, Tuple, Union # Añadido Union
+import multiprocessing
+import sqlite3
 import threading
+from types import MappingProxyType
 from contextlib import asynccontextmanager
 
 from models import (
@@ -18,7 +32,10 @@ from models import (
     LUTExplanationModel,
     PixelDataResponse,
     MoveRequest, # Modelo original para C-MOVE singular/jerárquico
-    BulkMoveRequest # Modelo para C-MOVE de múltiples instancias específicas
+    BulkMoveRequest, # Modelo para C-MOVE de múltiples instancias específicas
+    BatchSeriesRequest, BatchSeriesResponse, # Modelo para C-FIND de series de varios estudios
+    CMoveInstanceResult, # Resultado por instancia del C-MOVE masivo
+    as_primitive, header_key, is_valid_uid, TAG_STR_RE # Utilidades compartidas con main.py
 )
 
 import pydicom
@@ -26,13 +43,24 @@ from pydicom.tag import Tag
 from pydicom.datadict import keyword_for_tag, tag_for_keyword, dictionary_VR
 from pydicom.dataset import Dataset as DicomDataset
 from pydicom.datadict import dictionary_VR # Necesario para la lógica de 'fields'
-from pydicom.dataelem import DataElement
+from pydicom.dataelem import DataElement, RawDataElement
 from pydicom.multival import MultiValue
+from pydicom.charset import python_encoding
+from pydicom.pixels import iter_pixels, pixel_array # Decodificación de frames individuales (pydicom >= 3.0)
 
 import pacs_operations
 import config
 import dicom_scp
 
+# Configuración del PACS para pacs_operations. No cambia en tiempo de ejecución:
+# se construye una vez y se expone como solo lectura.
+PACS_CONFIG: Mapping[str, Any] = MappingProxyType({
+    "PACS_IP": config.PACS_IP,
+    "PACS_PORT": config.PACS_PORT,
+    "PACS_AET": config.PACS_AET,
+    "AE_TITLE": config.CLIENT_AET
+})
+
 # --- Configuración del Logger ---
 logger = logging.getLogger(__name__)
 if not logger.hasHandlers(): # Evitar añadir múltiples handlers si se importa o recarga
@@ -43,48 +71,223 @@ if not logger.hasHandlers(): # Evitar añadir múltiples handlers si se importa
         force=True # Para asegurar que se reconfigure si se llama varias veces
     )
 
+# VRs binarios: su valor no se lee al loguear para no materializar bytes innecesariamente.
+_BINARY_VRS = frozenset({'OB', 'OW', 'OF', 'OD', 'OL', 'UN'})
+
+# LUTExplanation (0028,3003): se compara en cada elemento de las secuencias, así que se construye una sola vez
+_LUT_EXPLANATION_TAG = Tag(0x0028, 0x3003)
+
+# Datos masivos que nunca se devuelven en dicom_headers. UN no se incluye: los PACS
+# devuelven así tags privados de texto, que se decodifican con el charset del dataset.
+_BULK_TAGS = frozenset({Tag(0x7FE0, 0x0010), Tag(0x7FE0, 0x0008), Tag(0x7FE0, 0x0009)}) # PixelData, FloatPixelData, DoubleFloatPixelData
+_BULK_VRS = frozenset({'OB', 'OW', 'OF', 'OD', 'OL', 'OV'})
+
+# Consultas al diccionario DICOM cacheadas: el diccionario de pydicom no cambia en
+# tiempo de ejecución y los mismos tags se repiten en cada dataset de respuesta.
+_vr_for_tag = functools.lru_cache(maxsize=4096)(dictionary_VR)
+
+# Keyword DICOM -> (Tag, VR), rellenado bajo demanda al aplicar filtros. Solo se
+# guardan keywords válidas, así que su tamaño está acotado por el diccionario DICOM.
+_KW_VR_CACHE: Dict[str, Tuple[Tag, str]] = {}
+
+def _tag_and_vr_for_keyword(keyword: str) -> Optional[Tuple[Tag, str]]:
+    """Devuelve (Tag, VR) para una keyword DICOM, o None si la keyword no existe."""
+    cached = _KW_VR_CACHE.get(keyword)
+    if cached is None:
+        tag_int = tag_for_keyword(keyword)
+        if tag_int is None:
+            return None
+        tag_obj = Tag(tag_int)
+        cached = _KW_VR_CACHE[keyword] = (tag_obj, _vr_for_tag(tag_obj))
+    return cached
+
+# Keywords que la API anuncia o usa en sus consultas: se resuelven al importar para que
+# las primeras peticiones ya encuentren (Tag, VR) en _KW_VR_CACHE.
+_KNOWN_KEYWORDS = (
+    "PatientID", "PatientName", "StudyDate", "AccessionNumber", "ModalitiesInStudy",
+    "StudyInstanceUID", "StudyDescription", "ReferringPhysicianName",
+    "SeriesInstanceUID", "Modality", "SeriesNumber", "SeriesDescription",
+    "SOPInstanceUID", "InstanceNumber", "KVP",
+)
+for _kw in _KNOWN_KEYWORDS:
+    _tag_and_vr_for_keyword(_kw)
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_tag(key: str) -> Optional[Tag]:
+    """
+    Resuelve una keyword DICOM o un tag en formato "(gggg,eeee)" a un objeto Tag.
+
+    Args:
+        key: Keyword (ej. 'KVP') o tag hexadecimal (ej. '(0020,4000)').
+
+    Returns:
+        El Tag correspondiente, o None si la keyword no existe o el formato es inválido.
+    """
+    if ',' in key:
+        match = TAG_STR_RE.match(key)
+        return Tag(int(match.group(1), 16), int(match.group(2), 16)) if match else None
+    tag_and_vr = _tag_and_vr_for_keyword(key)
+    return tag_and_vr[0] if tag_and_vr else None
+
+def parse_filters(
+    filters: Optional[str] = Query(None, description="JSON string for additional DICOM tag filtering, e.g., '{\"Modality\":\"CT\", \"(0008,0090)\":\"DOE^J\"}'")
+) -> Dict[str, Any]:
+    """
+    Dependencia FastAPI que decodifica el parámetro 'filters' una vez por petición.
+
+    Args:
+        filters: Cadena JSON con un objeto clave -> valor, o None.
+
+    Returns:
+        El diccionario de filtros (vacío si no se indicó 'filters').
+
+    Raises:
+        HTTPException: 400 si 'filters' no es un JSON válido o no es un objeto.
+    """
+    if not filters:
+        return {}
+    try:
+        filter_dict = orjson.loads(filters)
+    except orjson.JSONDecodeError as e_json:
+        logger.error(f"Error decodificando JSON en 'filters': {filters}. Error: {e_json}")
+        raise HTTPException(status_code=400, detail=f"Parámetro 'filters' con JSON inválido: {e_json}")
+    if not isinstance(filter_dict, dict):
+        raise HTTPException(status_code=400, detail="El parámetro 'filters' debe ser un objeto JSON (clave -> valor).")
+    return filter_dict
+
+def _apply_filters(identifier: DicomDataset, filter_dict: Dict[str, Any], ctx: str) -> None:
+    """
+    Aplica al identificador C-FIND los filtros genéricos ya decodificados por parse_filters.
+
+    Las claves pueden ser keywords DICOM o tags "(gggg,eeee)". Las claves no
+    reconocidas se omiten con un aviso en el log.
+
+    Args:
+        identifier: Dataset de consulta al que se añaden los filtros.
+        filter_dict: Diccionario clave -> valor devuelto por parse_filters.
+        ctx: Nivel de la consulta ("estudios", "series"), usado en los mensajes.
+    """
+    if not filter_dict:
+        return
+
+    add_new = identifier.add_new
+    for key, value in filter_dict.items():
+        try:
+            if isinstance(key, str) and ',' in key:
+                tag_obj = _resolve_tag(key)
+                if tag_obj is None: raise ValueError(key)
+                try: vr = _vr_for_tag(tag_obj)
+                except KeyError: vr = None # Tag privado o desconocido
+            else:
+                tag_and_vr = _tag_and_vr_for_keyword(str(key))
+                if not tag_and_vr:
+                    logger.warning(f"Keyword DICOM '{key}' en 'filters' para {ctx} no reconocido. Omitiendo.")
+                    continue
+                tag_obj, vr = tag_and_vr
+
+            if vr:
+                add_new(tag_obj, vr, value) # Evita la resolución keyword->tag->VR de setattr
+            else:
+                identifier[tag_obj] = value
+            logger.info(f"[_apply_filters] Aplicando filtro para {ctx}: Tag {tag_obj} ({key}) = '{value}'")
+
+        except ValueError:
+            logger.warning(f"Formato de tag inválido '{key}' en 'filters' para {ctx}. Omitiendo.")
+        except Exception as e_filter_tag:
+            logger.error(f"Error procesando tag de filtro para {ctx} '{key}': {e_filter_tag}", exc_info=True)
+
+# Campos que siempre queremos que se devuelvan con valor vacío si no se usan como filtro,
+# para que pynetdicom los solicite. Se resuelven a (Tag, VR) una sola vez al importar.
+_STUDY_RETURN_KEYS: Tuple[Tuple[Tag, str], ...] = tuple(
+    _tag_and_vr_for_keyword(kw) for kw in (
+        "StudyInstanceUID", "PatientID", "PatientName", "StudyDate",
+        "StudyDescription", "ModalitiesInStudy", "AccessionNumber"
+    )
+)
+_SERIES_RETURN_KEYS: Tuple[Tuple[Tag, str], ...] = tuple(
+    _tag_and_vr_for_keyword(kw) for kw in (
+        "SeriesInstanceUID", "Modality", "SeriesNumber", "SeriesDescription"
+        # "KVP" # Si quieres KVP a nivel de serie, y el PACS lo soporta
+    )
+)
+
+def _new_identifier(level: str, return_keys: Tuple[Tuple[Tag, str], ...]) -> DicomDataset:
+    """
+    Crea un identificador C-FIND con su nivel y los campos de retorno vacíos.
+
+    Se crean elementos nuevos en cada llamada (en lugar de copiar un Dataset plantilla),
+    porque pydicom comparte los DataElement en las copias superficiales.
+
+    Args:
+        level: QueryRetrieveLevel ("STUDY", "SERIES"...).
+        return_keys: Pares (Tag, VR) precalculados de los campos a devolver.
+
+    Returns:
+        El Dataset identificador listo para añadir filtros.
+    """
+    identifier = DicomDataset()
+    identifier.QueryRetrieveLevel = level
+    for tag_obj, vr in return_keys:
+        identifier.add_new(tag_obj, vr, "")
+    return identifier
+
 # --- Lifespan Manager para iniciar/detener el SCP ---
-scp_thread: Optional[threading.Thread] = None
+scp_process: Optional[multiprocessing.Process] = None
 
 @asynccontextmanager
 async def lifespan(app_lifespan: FastAPI): # Renombrado el parámetro para claridad
     """
     Gestiona el ciclo de vida de la aplicación FastAPI.
 
-    Inicia un servidor DICOM C-STORE SCP (Service Class Provider) en un hilo 
+    Inicia un servidor DICOM C-STORE SCP (Service Class Provider) en un proceso
     separado al arrancar la aplicación y lo detiene de forma segura al apagarla.
+    Al ser otro proceso, la recepción y escritura de imágenes no compite por el GIL
+    con los endpoints; ambos comparten únicamente el directorio de recepción.
 
     Args:
         app_lifespan (FastAPI): La instancia de la aplicación FastAPI.
     """
-    global scp_thread
+    global scp_process
     logger.info("Iniciando aplicación FastAPI y servidor DICOM C-STORE SCP...")
     print("[FastAPI App] Iniciando aplicación y servidor DICOM C-STORE SCP...")
     
-    scp_thread = threading.Thread(target=dicom_scp.start_scp_server, daemon=True)
-    scp_thread.start()
+    scp_stop_event = multiprocessing.Event() # Apagado ordenado: el hijo termina sus C-STORE en curso
+    scp_process = multiprocessing.Process(
+        target=dicom_scp.start_scp_server, kwargs={"stop_event": scp_stop_event}, name="dicom-scp", daemon=True
+    )
+    scp_process.start()
     
     yield 
 
     logger.info("Deteniendo aplicación FastAPI...")
     print("[FastAPI App] Deteniendo aplicación FastAPI...")
     
-    if hasattr(dicom_scp, 'ae_scp') and dicom_scp.ae_scp and dicom_scp.ae_scp.is_running:
-         print("[FastAPI App] Solicitando apagado del servidor SCP...")
-         dicom_scp.ae_scp.shutdown() 
-    
-    if scp_thread and scp_thread.is_alive():
-        print("[FastAPI App] Esperando que el hilo del SCP termine...")
-        scp_thread.join(timeout=10.0) 
-        if scp_thread.is_alive():
-             logger.warning("[FastAPI App] Advertencia: El hilo del servidor SCP no terminó limpiamente.")
+    if scp_process and scp_process.is_alive():
+        print("[FastAPI App] Solicitando apagado del servidor SCP...")
+        scp_stop_event.set() # El hijo deja de aceptar asociaciones y espera a las activas
+        await asyncio.to_thread(scp_process.join, config.SCP_SHUTDOWN_TIMEOUT + 5.0)
+        if scp_process.is_alive():
+            # Último recurso: los ficheros se escriben con rename atómico, así que no quedan .dcm truncados
+            logger.warning("[FastAPI App] Advertencia: El proceso del servidor SCP no terminó a tiempo; se fuerza su parada.")
+            scp_process.terminate()
+            await asyncio.to_thread(scp_process.join, 5.0)
+    _close_preview_db()
     print("[FastAPI App] Apagado completado.")
 
+# MessagePack opcional para la vista previa de píxeles: los números viajan en binario, sin
+# pasar a texto. Solo se usa si el cliente lo pide con `Accept: application/x-msgpack`.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_MSGPACK_MEDIA_TYPE = "application/x-msgpack"
 
 app = FastAPI(
     title="API de Consultas PACS DICOM (con C-STORE SCP y Filtros Dinámicos)", 
     version="1.3.0", # Versión incrementada para reflejar cambios
     lifespan=lifespan,
+    default_response_class=ORJSONResponse, # Las respuestas de instancias (headers + SQ) son las más grandes
     swagger_favicon_url="/favicon.ico",
     redoc_favicon_url="/favicon.ico"
 )
@@ -108,10 +311,10 @@ def _parse_range_to_floats(range_str: Optional[str]) -> Optional[Tuple[float, fl
     """
     if not range_str: return None
     try:
-        parts = range_str.strip().split('-')
-        if len(parts) == 1: val = float(parts[0].strip()); return (val, val) 
-        elif len(parts) == 2: return (float(parts[0].strip()), float(parts[1].strip()))
-        else: logger.warning(f"Formato de rango inesperado: '{range_str}'."); return None
+        start_str, sep, end_str = range_str.partition('-') # float() ya ignora los espacios alrededor
+        if not sep: val = float(start_str); return (val, val)
+        if '-' in end_str: logger.warning(f"Formato de rango inesperado: '{range_str}'."); return None
+        return (float(start_str), float(end_str))
     except ValueError: logger.warning(f"Error al convertir valores del rango '{range_str}' a flotantes."); return None
 
 def parse_lut_explanation(explanation_str_raw: Optional[Any]) -> LUTExplanationModel:
@@ -128,29 +331,258 @@ def parse_lut_explanation(explanation_str_raw: Optional[Any]) -> LUTExplanationM
         Un objeto LUTExplanationModel con los campos parseados.
     """
     if explanation_str_raw is None: return LUTExplanationModel(FullText=None)
-    text = str(explanation_str_raw)
-    explanation_part = text 
+    return _parse_lut_explanation_str(str(explanation_str_raw))
+
+# Las explicaciones de LUT se repiten en todas las instancias de una serie: se cachea el
+# resultado por texto. Los consumidores no deben modificar el modelo devuelto.
+@functools.lru_cache(maxsize=2048)
+def _parse_lut_explanation_str(text: str) -> LUTExplanationModel:
+    """Parsea el texto de un LUTExplanation ya convertido a str (ver parse_lut_explanation)."""
+    # Formato fijo "<texto> [InCalibRange: a-b] [OutLUTRange: c-d]": basta con localizar
+    # las dos etiquetas literales y cortar, sin pasar por el motor de expresiones regulares.
+    stripped = text.strip()
+    in_idx = stripped.find("InCalibRange:")
+    out_idx = stripped.find("OutLUTRange:")
     in_calib_range_parsed: Optional[Tuple[float, float]] = None
     out_lut_range_parsed: Optional[Tuple[float, float]] = None
-    regex_pattern = r"^(.*?)(?:InCalibRange:\s*([0-9\.\-]+))?\s*(?:OutLUTRange:\s*([0-9\.\-]+))?$"
-    match = re.fullmatch(regex_pattern, text.strip())
-    if match:
-        explanation_part = match.group(1).strip() if match.group(1) else ""
-        in_calib_range_str = match.group(2); out_lut_range_str = match.group(3)
-        if in_calib_range_str: in_calib_range_parsed = _parse_range_to_floats(in_calib_range_str.strip())
-        if out_lut_range_str: out_lut_range_parsed = _parse_range_to_floats(out_lut_range_str.strip())
-        if in_calib_range_parsed is None and "InCalibRange:" in explanation_part:
-            temp_parts = explanation_part.split("InCalibRange:", 1); explanation_part = temp_parts[0].strip()
-            if len(temp_parts) > 1: temp_in_calib_parts = temp_parts[1].split("OutLUTRange:", 1); in_calib_range_parsed = _parse_range_to_floats(temp_in_calib_parts[0].strip())
-        if out_lut_range_parsed is None and "OutLUTRange:" in explanation_part:
-            temp_parts = explanation_part.split("OutLUTRange:", 1)
-            if "InCalibRange:" not in temp_parts[0]: explanation_part = temp_parts[0].strip()
-            if len(temp_parts) > 1: out_lut_range_parsed = _parse_range_to_floats(temp_parts[1].strip())
-    else: 
-        logger.debug(f"Regex principal no coincidió para LUTExplanation: '{text}'. Usando texto completo como explicación.")
-        explanation_part = text # Mantener el texto original si el regex no capta nada
+
+    explanation_end = min((idx for idx in (in_idx, out_idx) if idx >= 0), default=len(stripped))
+    explanation_part = stripped[:explanation_end].strip()
+    if in_idx >= 0:
+        in_end = out_idx if out_idx > in_idx else len(stripped)
+        in_calib_range_parsed = _parse_range_to_floats(stripped[in_idx + len("InCalibRange:"):in_end].strip())
+    if out_idx >= 0:
+        out_end = in_idx if in_idx > out_idx else len(stripped)
+        out_lut_range_parsed = _parse_range_to_floats(stripped[out_idx + len("OutLUTRange:"):out_end].strip())
+
     return LUTExplanationModel(FullText=text, Explanation=explanation_part if explanation_part else None, InCalibRange=in_calib_range_parsed, OutLUTRange=out_lut_range_parsed)
 
+def _study_response_from_dataset(res_ds: DicomDataset) -> StudyResponse:
+    """Construye un StudyResponse a partir de un dataset de resultado C-FIND a nivel de estudio."""
+    get = res_ds.get
+    return StudyResponse.model_construct( # Sin validación: los valores se normalizan aquí
+        StudyInstanceUID=as_primitive(get("StudyInstanceUID", "")),
+        PatientID=as_primitive(get("PatientID", "")),
+        PatientName=str(get("PatientName", "")),
+        StudyDate=as_primitive(get("StudyDate", "")),
+        StudyDescription=as_primitive(get("StudyDescription", "")),
+        ModalitiesInStudy=as_primitive(get("ModalitiesInStudy", "")),
+        AccessionNumber=as_primitive(get("AccessionNumber", ""))
+    )
+
+def _series_response_from_dataset(res_ds: DicomDataset, study_instance_uid: str) -> SeriesResponse:
+    """
+    Construye un SeriesResponse a partir de un dataset de resultado C-FIND a nivel de serie.
+
+    Args:
+        res_ds: Dataset devuelto por el PACS para una serie.
+        study_instance_uid: UID del estudio consultado, usado si el PACS no lo devuelve.
+
+    Returns:
+        Un objeto SeriesResponse con los campos de la serie.
+    """
+    get = res_ds.get
+    series_number = get("SeriesNumber")
+    kvp = get("KVP") # Tag de instancia que algunos PACS devuelven a nivel de serie; puede ser None
+
+    # Datos del PACS ya normalizados: model_construct evita la validación por fila
+    return SeriesResponse.model_construct(
+        StudyInstanceUID=as_primitive(get("StudyInstanceUID", study_instance_uid)),
+        SeriesInstanceUID=as_primitive(get("SeriesInstanceUID", "")),
+        Modality=as_primitive(get("Modality", "")),
+        # IS de pydicom es un int: int.__str__ normaliza ("003" -> "3") sin pasar por int() ni str() intermedios
+        SeriesNumber=None if series_number is None else (int.__str__(series_number) if isinstance(series_number, int) else str(series_number)),
+        SeriesDescription=as_primitive(get("SeriesDescription", "")),
+        KVP=None if kvp is None else str(kvp)
+    )
+
+def _conv_item_value(value: Any) -> Optional[str]:
+    """Conversión de un valor dentro de un item de secuencia (None se mantiene como None)."""
+    if isinstance(value, str):
+        return value
+    return str(value) if value is not None else None
+
+def _convert_sq(sequence: Sequence[DicomDataset]) -> List[Dict[str, Any]]:
+    """
+    Convierte los items de una secuencia (SQ) en diccionarios, incluidas las secuencias anidadas.
+
+    Las secuencias anidadas se procesan con una cola de trabajo en lugar de recursión:
+    cada SQ encontrada reserva su lista de salida y se encola para rellenarla después.
+
+    Args:
+        sequence: El valor de un elemento SQ (secuencia de datasets).
+
+    Returns:
+        Una lista con un diccionario keyword (o tag) -> valor por cada item de la secuencia.
+        LUTExplanation se devuelve parseado como LUTExplanationModel.
+    """
+    result: List[Optional[Dict[str, Any]]] = [None] * len(sequence)
+    worklist: Deque[Tuple[Sequence[DicomDataset], List[Optional[Dict[str, Any]]]]] = deque([(sequence, result)])
+    while worklist:
+        current_sequence, output = worklist.popleft()
+        for index, item_dataset in enumerate(current_sequence):
+            item_dict: Dict[str, Any] = {}
+            for item_element in item_dataset:
+                key = header_key(item_element.tag)
+                if item_element.VR == 'SQ':
+                    child_output: List[Optional[Dict[str, Any]]] = [None] * len(item_element.value)
+                    item_dict[key] = child_output
+                    worklist.append((item_element.value, child_output))
+                elif item_element.tag == _LUT_EXPLANATION_TAG:
+                    item_dict[key] = parse_lut_explanation(item_element.value)
+                else:
+                    item_dict[key] = _conv_item_value(item_element.value)
+            output[index] = item_dict
+    return result
+
+def _final_move_status(move_responses: List[Tuple[Optional[DicomDataset], Any]]) -> Tuple[Optional[DicomDataset], int, int, int]:
+    """
+    Obtiene el estado final de una operación C-MOVE y sus contadores de sub-operaciones.
+
+    Args:
+        move_responses: Lista de tuplas (status_dataset, identifier_dataset) devuelta por el C-MOVE.
+
+    Returns:
+        Una tupla (status_final, completadas, fallidas, advertencias). Solo se lee el
+        último dataset de estado no nulo, que es el que refleja el resultado global.
+    """
+    final_status_ds = next((status_ds for status_ds, _ in reversed(move_responses or []) if status_ds), None)
+    if final_status_ds is None:
+        return None, 0, 0, 0
+    return (
+        final_status_ds,
+        final_status_ds.get("NumberOfCompletedSuboperations", 0),
+        final_status_ds.get("NumberOfFailedSuboperations", 0),
+        final_status_ds.get("NumberOfWarningSuboperations", 0),
+    )
+
+def _codec_for_dataset(ds: DicomDataset) -> str:
+    """
+    Resuelve el codec de Python correspondiente al SpecificCharacterSet de un dataset.
+
+    Args:
+        ds: Dataset cuyo juego de caracteres se quiere conocer.
+
+    Returns:
+        El nombre del codec de Python (por defecto 'iso8859', equivalente a ISO_IR 100).
+    """
+    charset = ds.get("SpecificCharacterSet", "ISO_IR 100")
+    if isinstance(charset, MultiValue): # Con extensiones de código, el primer valor es el juego por defecto
+        charset = charset[0] if charset else "ISO_IR 100"
+    return python_encoding.get(charset or "ISO_IR 100", "iso8859")
+
+def _conv_value(value: Any) -> Union[str, List[str]]:
+    """Conversión por defecto de un valor DICOM: str, o lista de str si es multivaluado."""
+    if isinstance(value, MultiValue):
+        return list(map(str, value)) # IS/DS/US... ya son numéricos: una sola conversión a str
+    if isinstance(value, str): # LO, SH, CS, UI, AE...: ya es texto, sin llamar a str()
+        return value
+    return str(value) if value is not None else ""
+
+# DS/IS: en un C-FIND suelen llegar sin convertir (RawDataElement). Convertirlos crea un
+# DSfloat/IS por valor solo para volver a pasarlo a str; con los bytes basta con trocear.
+_NUMERIC_STRING_VRS = frozenset({'DS', 'IS'})
+
+def _raw_vr(tag: Tag) -> Optional[str]:
+    """VR de diccionario para un elemento recibido en VR implícito (None si el tag no se conoce)."""
+    try:
+        return _vr_for_tag(tag)
+    except KeyError:
+        return None
+
+def _split_numeric_string(raw_value: bytes) -> Union[str, List[str]]:
+    """Valor DS/IS en bytes -> str, o lista de str si es multivaluado (igual que str() de pydicom)."""
+    text = raw_value.decode('ascii', errors='replace')
+    if '\\' in text:
+        return [part.strip(' \x00') for part in text.split('\\')]
+    return text.strip(' \x00')
+
+def _parse_numeric_string(raw_value: bytes, vr: str) -> Any:
+    """
+    Valor DS/IS en bytes -> float/int (o lista) para HEADERS_NUMERIC_AS_STRING = False.
+
+    Los valores vacíos se devuelven como None y, si alguno no es un número válido,
+    se devuelve el texto tal cual (mismo resultado que con el modo texto).
+    """
+    parts = _split_numeric_string(raw_value)
+    number = int if vr == 'IS' else float
+    try:
+        if isinstance(parts, list):
+            return [number(part) if part else None for part in parts]
+        return number(parts) if parts else None
+    except ValueError:
+        return parts
+
+def _conv_number(value: Any) -> Any:
+    """DSfloat/DSdecimal/IS ya convertidos -> float/int nativos (orjson no serializa subclases de float ni Decimal)."""
+    if isinstance(value, MultiValue):
+        return [_conv_number(v) for v in value]
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, (float, Decimal)): # DSdecimal con pydicom.config.use_DS_decimal
+        return float(value)
+    return value # None o texto no numérico
+
+# Conversores por VR para los dicom_headers. Los VRs sin entrada usan _conv_value,
+# de modo que el bucle de cabeceras hace un único lookup por elemento.
+_VR_HANDLERS: Dict[str, Callable[[Any], Any]] = {
+    'SQ': _convert_sq,
+}
+if not config.HEADERS_NUMERIC_AS_STRING:
+    _VR_HANDLERS.update({'DS': _conv_number, 'IS': _conv_number})
+
+def _headers_from_dataset(res_ds: DicomDataset, requested_tags: Dict[str, Tag], expand_sequences: bool = False) -> Dict[str, Any]:
+    """
+    Construye el diccionario dicom_headers de una instancia a partir de su dataset C-FIND.
+
+    Args:
+        res_ds: Dataset devuelto por el PACS para una instancia.
+        requested_tags: Tags pedidos en 'fields'. Si está vacío se devuelven todos los del dataset.
+        expand_sequences: Si es False, las secuencias (SQ) no pedidas explícitamente en
+                          'fields' se resumen en lugar de convertirse item a item.
+
+    Returns:
+        Un diccionario keyword (o tag) -> valor convertido a tipos serializables.
+    """
+    headers: Dict[str, Any] = {}
+    # Sin 'fields' se recorren las claves tal cual: el dataset decodificado del C-FIND ya
+    # las tiene en orden de tag (el de llegada). No se usa iter(res_ds) porque convertiría
+    # cada elemento antes de poder aprovechar la vía rápida de DS/IS en bruto.
+    tags = requested_tags.values() if requested_tags else res_ds.keys()
+
+    codec: Optional[str] = None # Se resuelve una vez por dataset y solo si hay valores binarios
+    for tag_obj in tags:
+        if tag_obj in _BULK_TAGS: # PixelData y similares se descartan antes de leer el elemento
+            continue
+        # Una sola búsqueda por tag. get_item no convierte: DS/IS se trocean directamente
+        # desde los bytes recibidos
+        element = res_ds.get_item(tag_obj)
+        if element is None: # El PACS no devolvió el tag
+            continue
+        if isinstance(element, RawDataElement):
+            if element.value is not None:
+                vr = element.VR or _raw_vr(tag_obj)
+                if vr in _NUMERIC_STRING_VRS:
+                    headers[header_key(tag_obj)] = (
+                        _split_numeric_string(element.value) if config.HEADERS_NUMERIC_AS_STRING
+                        else _parse_numeric_string(element.value, vr)
+                    )
+                    continue
+            element = res_ds[tag_obj] # Única conversión del elemento en bruto (con el charset del dataset)
+        key_to_use = header_key(tag_obj)
+
+        if element.VR in _BULK_VRS:
+            headers[key_to_use] = f"Binary data (VR: {element.VR})"
+        elif element.VR == 'SQ' and not expand_sequences and not requested_tags:
+            headers[key_to_use] = f"Sequence[{len(element.value)} items, not expanded]"
+        elif isinstance(element.value, bytes):
+            if codec is None:
+                codec = _codec_for_dataset(res_ds)
+            headers[key_to_use] = element.value.decode(codec, errors='replace').strip('\x00 ')
+        else:
+            headers[key_to_use] = _VR_HANDLERS.get(element.VR, _conv_value)(element.value)
+    return headers
+
 # --- Endpoints ---
 @app.get("/")
 async def root():
@@ -159,19 +591,32 @@ async def root():
     """
     return {"message": "Bienvenido a la API de Consultas PACS DICOM"}
 
+# Favicon cargado en memoria una sola vez al importar, con un ETag fijo para que
+# las peticiones repetidas del navegador se resuelvan con un 304 sin tocar disco.
+_FAVICON_PATH = os.path.join(os.path.dirname(__file__), "xray.ico")
+_FAVICON_BYTES: Optional[bytes] = None
+_FAVICON_ETAG: Optional[str] = None
+if os.path.exists(_FAVICON_PATH):
+    with open(_FAVICON_PATH, "rb") as favicon_file:
+        _FAVICON_BYTES = favicon_file.read()
+    _FAVICON_ETAG = f'"{hashlib.sha256(_FAVICON_BYTES).hexdigest()}"'
+_FAVICON_HEADERS = {"ETag": _FAVICON_ETAG or "", "Cache-Control": "public, max-age=86400"}
+
 @app.get("/favicon.ico", include_in_schema=False)
-async def favicon():
+async def favicon(request: Request):
     # ... (comentarios)
-    favicon_path = os.path.join(os.path.dirname(__file__), "xray.ico")
-    if os.path.exists(favicon_path):
-        return FileResponse(favicon_path)
+    if _FAVICON_BYTES is not None:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _FAVICON_ETAG in (etag.strip() for etag in if_none_match.split(",")):
+            return Response(status_code=304, headers=_FAVICON_HEADERS)
+        return Response(content=_FAVICON_BYTES, media_type="image/x-icon", headers=_FAVICON_HEADERS)
     else:
         # ... (manejo de error)
-        logger.warning(f"Favicon no encontrado en: {favicon_path}")
+        logger.warning(f"Favicon no encontrado en: {_FAVICON_PATH}")
         raise HTTPException(status_code=404, detail="Favicon not found")
 
 
-@app.get("/studies", response_model=List[StudyResponse])
+@app.get("/studies", responses={200: {"model": List[StudyResponse]}})
 async def find_studies_endpoint(
     # Parámetros de consulta específicos que son comunes
     PatientID_param: Optional[str] = Query(None, alias="PatientID", description="Patient ID to filter by."),
@@ -180,7 +625,7 @@ async def find_studies_endpoint(
     ModalitiesInStudy_param: Optional[str] = Query(None, alias="ModalitiesInStudy", description="Modalities in Study (e.g., CT, MR)."),
     PatientName_param: Optional[str] = Query(None, alias="PatientName", description="Patient's Name for filtering."),
     # Parámetro de filtros genéricos
-    filters: Optional[str] = Query(None, description="JSON string for additional DICOM tag filtering, e.g., '{\"ReferringPhysicianName\":\"DOE^J\", \"(0008,0090)\":\"DOE^J\"}'")
+    filters: Dict[str, Any] = Depends(parse_filters)
 ):
     """
     Realiza una consulta C-FIND a nivel de estudio (STUDY) contra el PACS.
@@ -194,22 +639,12 @@ async def find_studies_endpoint(
         AccessionNumber_param: Número de acceso.
         ModalitiesInStudy_param: Modalidades en el estudio.
         PatientName_param: Nombre del paciente.
-        filters: Una cadena JSON con pares tag-valor para filtros adicionales.
+        filters: Filtros adicionales tag-valor, decodificados del parámetro JSON 'filters'.
 
     Returns:
         Una lista de objetos StudyResponse con los resultados de la búsqueda.
     """
-    identifier = DicomDataset()
-    identifier.QueryRetrieveLevel = "STUDY"
-
-    # Campos que siempre queremos que se devuelvan con valor vacío si no se usan como filtro,
-    # para que pynetdicom los solicite.
-    base_return_fields = {
-        "StudyInstanceUID": "", "PatientID": "", "PatientName": "", "StudyDate": "",
-        "StudyDescription": "", "ModalitiesInStudy": "", "AccessionNumber": ""
-    }
-    for kw, val in base_return_fields.items():
-        setattr(identifier, kw, val)
+    identifier = _new_identifier("STUDY", _STUDY_RETURN_KEYS)
 
     # Aplicar parámetros de consulta específicos (tienen precedencia o se combinan)
     if PatientID_param is not None: identifier.PatientID = PatientID_param
@@ -219,69 +654,24 @@ async def find_studies_endpoint(
     if PatientName_param is not None: identifier.PatientName = PatientName_param
     
     # Aplicar filtros genéricos del JSON
-    if filters:
-        try:
-            filter_dict = json.loads(filters)
-            for key, value in filter_dict.items():
-                tag_obj: Optional[Tag] = None
-                original_key_for_log = key
-                try:
-                    if isinstance(key, str) and ',' in key: 
-                        group_str, elem_str = key.strip("() ").split(',')
-                        tag_obj = Tag(int(group_str, 16), int(elem_str, 16))
-                    else: 
-                        tag_val_from_kw = tag_for_keyword(str(key))
-                        if tag_val_from_kw:
-                            tag_obj = Tag(tag_val_from_kw)
-                        else:
-                            logger.warning(f"Keyword DICOM '{original_key_for_log}' en 'filters' para estudios no reconocido. Omitiendo.")
-                            continue
-                    
-                    dicom_keyword = keyword_for_tag(tag_obj)
-                    if dicom_keyword:
-                        setattr(identifier, dicom_keyword, value)
-                    else:
-                        identifier[tag_obj] = value
-                    logger.info(f"[find_studies_endpoint] Aplicando filtro: Tag {tag_obj} ({original_key_for_log}) = '{value}'")
-
-                except ValueError:
-                    logger.warning(f"Formato de tag inválido '{original_key_for_log}' en 'filters' para estudios. Omitiendo.")
-                except Exception as e_filter_tag:
-                    logger.error(f"Error procesando tag de filtro para estudios '{original_key_for_log}': {e_filter_tag}", exc_info=True)
-        
-        except json.JSONDecodeError as e_json:
-            logger.error(f"Error decodificando JSON en 'filters' para estudios: {filters}. Error: {e_json}")
-            raise HTTPException(status_code=400, detail=f"Parámetro 'filters' con JSON inválido: {e_json}")
+    _apply_filters(identifier, filters, "estudios")
     
-    logger.debug(f"[find_studies_endpoint] Identificador C-FIND final:\n{identifier}")
-    pacs_config_dict = {
-        "PACS_IP": config.PACS_IP, "PACS_PORT": config.PACS_PORT,
-        "PACS_AET": config.PACS_AET, "AE_TITLE": config.CLIENT_AET
-    }
+    if logger.isEnabledFor(logging.DEBUG): # str(identifier) recorre todo el dataset: solo si se va a loguear
+        logger.debug(f"[find_studies_endpoint] Identificador C-FIND final:\n{identifier}")
     try:
         results_datasets = await pacs_operations.perform_c_find_async(
-            identifier, pacs_config_dict, query_model_uid='S'
+            identifier, PACS_CONFIG, query_model_uid='S'
         )
-        response_studies: List[StudyResponse] = []
-        for res_ds in results_datasets:
-            response_studies.append(StudyResponse(
-                StudyInstanceUID=res_ds.get("StudyInstanceUID", ""),
-                PatientID=res_ds.get("PatientID", ""),
-                PatientName=str(res_ds.get("PatientName", "")), 
-                StudyDate=res_ds.get("StudyDate", ""),
-                StudyDescription=res_ds.get("StudyDescription", ""),
-                ModalitiesInStudy=res_ds.get("ModalitiesInStudy", ""),
-                AccessionNumber=res_ds.get("AccessionNumber", "")
-            ))
-        return response_studies
+        # ORJSONResponse directa: con response_model FastAPI volvería a validar cada fila construida sin validar
+        return ORJSONResponse([_study_response_from_dataset(res_ds).model_dump() for res_ds in results_datasets])
     except Exception as e:
         logger.error(f"Error en C-FIND de estudios: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error during PACS query: {str(e)}")
 
-@app.get("/studies/{study_instance_uid}/series", response_model=List[SeriesResponse])
+@app.get("/studies/{study_instance_uid}/series", responses={200: {"model": List[SeriesResponse]}})
 async def find_series_in_study(
     study_instance_uid: str,
-    filters: Optional[str] = Query(None, description="JSON string for DICOM tag filtering, e.g., '{\"Modality\":\"CT\", \"(0018,0015)\":\"CHEST\"}'")
+    filters: Dict[str, Any] = Depends(parse_filters)
 ):
     """
     Realiza una consulta C-FIND a nivel de serie (SERIES) para un estudio dado.
@@ -291,124 +681,119 @@ async def find_series_in_study(
 
     Args:
         study_instance_uid: El UID del estudio a consultar.
-        filters: Una cadena JSON con pares tag-valor para filtros adicionales.
+        filters: Filtros adicionales tag-valor, decodificados del parámetro JSON 'filters'.
 
     Returns:
         Una lista de objetos SeriesResponse con los resultados.
     """
-    identifier = DicomDataset()
-    identifier.QueryRetrieveLevel = "SERIES"
+    identifier = _new_identifier("SERIES", _SERIES_RETURN_KEYS)
     identifier.StudyInstanceUID = study_instance_uid
-    
-    base_return_fields = {
-        "SeriesInstanceUID": "", "Modality": "", "SeriesNumber": "", "SeriesDescription": ""
-        # "KVP": "" # Si quieres KVP a nivel de serie, y el PACS lo soporta
-    }
-    for kw, val in base_return_fields.items():
-        setattr(identifier, kw, val)
 
-    if filters:
-        try:
-            filter_dict = json.loads(filters)
-            for key, value in filter_dict.items():
-                tag_obj: Optional[Tag] = None
-                original_key_for_log = key
-                try:
-                    if isinstance(key, str) and ',' in key: 
-                        group_str, elem_str = key.strip("() ").split(',')
-                        tag_obj = Tag(int(group_str, 16), int(elem_str, 16))
-                    else: 
-                        tag_val_from_kw = tag_for_keyword(str(key))
-                        if tag_val_from_kw:
-                            tag_obj = Tag(tag_val_from_kw)
-                        else:
-                            logger.warning(f"Keyword DICOM '{original_key_for_log}' en 'filters' para series no reconocido. Omitiendo.")
-                            continue
-                    
-                    dicom_keyword = keyword_for_tag(tag_obj)
-                    if dicom_keyword:
-                        setattr(identifier, dicom_keyword, value)
-                    else:
-                        identifier[tag_obj] = value
-                    logger.info(f"[find_series_in_study] Aplicando filtro: Tag {tag_obj} ({original_key_for_log}) = '{value}'")
-
-                except ValueError:
-                    logger.warning(f"Formato de tag inválido '{original_key_for_log}' en 'filters' para series. Omitiendo.")
-                except Exception as e_filter_tag:
-                    logger.error(f"Error procesando tag de filtro para series '{original_key_for_log}': {e_filter_tag}", exc_info=True)
-        except json.JSONDecodeError as e_json:
-            logger.error(f"Error decodificando JSON en 'filters' para series: {filters}. Error: {e_json}")
-            raise HTTPException(status_code=400, detail=f"Parámetro 'filters' con JSON inválido para series: {e_json}")
-
-    logger.debug(f"[find_series_in_study] Identificador C-FIND final:\n{identifier}")
-    logger.info(f"----------------------------------------------------------------")
-    logger.info(f"IDENTIFICADOR C-FIND FINAL QUE SE ENVÍA AL PACS:")
-    logger.info(f"StudyInstanceUID: {identifier.get('StudyInstanceUID', 'NO PRESENTE')}")
-    logger.info(f"SeriesInstanceUID: {identifier.get('SeriesInstanceUID', 'NO PRESENTE')}")
-    logger.info(f"QueryRetrieveLevel: {identifier.get('QueryRetrieveLevel', 'NO PRESENTE')}")
-    logger.info(f"SOPInstanceUID: '{identifier.get('SOPInstanceUID', 'NO PRESENTE')}'")
-    logger.info(f"InstanceNumber: '{identifier.get('InstanceNumber', 'NO PRESENTE')}'")
-    
-    # Mostrar los campos que se usaron para filtrar o solicitar
-    logger.info(f"Contenido completo del identificador a enviar:")
-    for elem in identifier:
-        # Para una mejor visualización, puedes optar por no loguear tags binarios largos aquí
-        # o limitar la longitud del valor.
-        value_to_log = elem.value
-        if isinstance(value_to_log, bytes) and len(value_to_log) > 64: # Evitar logs muy largos para datos binarios
-            value_to_log = f"<bytes de longitud {len(elem.value)}>"
-        
-        if elem.keyword: # Mostrar campos con keyword
-            logger.info(f"    {elem.keyword} ({elem.tag}): VR='{elem.VR}', Value='{value_to_log}'")
-        else: # Mostrar campos sin keyword (ej. privados)
-            logger.info(f"    ({elem.tag}): VR='{elem.VR}', Value='{value_to_log}'")
-    logger.info(f"----------------------------------------------------------------")    
-    pacs_config_dict = {
-        "PACS_IP": config.PACS_IP, "PACS_PORT": config.PACS_PORT,
-        "PACS_AET": config.PACS_AET, "AE_TITLE": config.CLIENT_AET
-    }
+    _apply_filters(identifier, filters, "series")
+
+    # El volcado detallado solo se construye si el nivel DEBUG está activo: evita
+    # formatear strings e iterar los elementos del dataset en producción.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[find_series_in_study] Identificador C-FIND final:\n{identifier}")
+        logger.debug(f"----------------------------------------------------------------")
+        logger.debug(f"IDENTIFICADOR C-FIND FINAL QUE SE ENVÍA AL PACS:")
+        logger.debug(f"StudyInstanceUID: {identifier.get('StudyInstanceUID', 'NO PRESENTE')}")
+        logger.debug(f"SeriesInstanceUID: {identifier.get('SeriesInstanceUID', 'NO PRESENTE')}")
+        logger.debug(f"QueryRetrieveLevel: {identifier.get('QueryRetrieveLevel', 'NO PRESENTE')}")
+        logger.debug(f"SOPInstanceUID: '{identifier.get('SOPInstanceUID', 'NO PRESENTE')}'")
+        logger.debug(f"InstanceNumber: '{identifier.get('InstanceNumber', 'NO PRESENTE')}'")
+
+        # Mostrar los campos que se usaron para filtrar o solicitar
+        logger.debug(f"Contenido completo del identificador a enviar:")
+        for elem in identifier:
+            # Para una mejor visualización, puedes optar por no loguear tags binarios largos aquí
+            # o limitar la longitud del valor.
+            if elem.VR in _BINARY_VRS: # Evitar leer (y loguear) datos binarios
+                value_to_log = f"<{elem.VR} binario>"
+            else:
+                value_to_log = elem.value
+                if type(value_to_log) is str: # Textos largos (LT/UT...) se recortan
+                    value_len = len(value_to_log)
+                    if value_len > 64:
+                        value_to_log = f"{value_to_log[:64]}... (len {value_len})"
+
+            if elem.keyword: # Mostrar campos con keyword
+                logger.debug(f"    {elem.keyword} ({elem.tag}): VR='{elem.VR}', Value='{value_to_log}'")
+            else: # Mostrar campos sin keyword (ej. privados)
+                logger.debug(f"    ({elem.tag}): VR='{elem.VR}', Value='{value_to_log}'")
+        logger.debug(f"----------------------------------------------------------------")
     try:
         results_datasets = await pacs_operations.perform_c_find_async(
-            identifier, pacs_config_dict, query_model_uid='S' 
+            identifier, PACS_CONFIG, query_model_uid='S' 
         )
-        response_list: List[SeriesResponse] = []
-        for res_ds in results_datasets:
-            series_number_raw = res_ds.get("SeriesNumber")
-            series_number_for_pydantic: Optional[str] = None
-            if series_number_raw is not None:
-                try: series_number_for_pydantic = str(int(str(series_number_raw))) # Asegurar que es string antes de int
-                except (ValueError, TypeError): series_number_for_pydantic = str(series_number_raw)
-            
-            # KVP es un tag de nivel de instancia, pero algunos PACS pueden devolverlo a nivel de serie si es consistente.
-            # Lo incluimos en el modelo SeriesResponse, pero puede ser None.
-            kvp_val = res_ds.get("KVP") 
-            kvp_for_pydantic: Optional[str] = None
-            if kvp_val is not None:
-                 kvp_for_pydantic = str(kvp_val)
-
-
-            response_list.append(SeriesResponse(
-                StudyInstanceUID=res_ds.get("StudyInstanceUID", study_instance_uid),
-                SeriesInstanceUID=res_ds.get("SeriesInstanceUID", ""),
-                Modality=res_ds.get("Modality", ""),
-                SeriesNumber=series_number_for_pydantic,
-                SeriesDescription=res_ds.get("SeriesDescription", ""),
-                KVP=kvp_for_pydantic # Añadido al modelo de respuesta si lo necesitas
-            ))
-        return response_list
+        return ORJSONResponse([_series_response_from_dataset(res_ds, study_instance_uid).model_dump() for res_ds in results_datasets])
     except Exception as e:
         logger.error(f"Error en C-FIND de series: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error interno al consultar series: {str(e)}")
 
 
+@app.post("/studies:batch-series", responses={200: {"model": BatchSeriesResponse}}, summary="Busca las series de varios estudios en una única asociación")
+async def find_series_in_studies_batch(request_data: BatchSeriesRequest):
+    """
+    Realiza una consulta C-FIND a nivel de serie (SERIES) para varios estudios.
+
+    Todas las consultas se envían sobre una misma asociación con el PACS, lo que
+    evita pagar el establecimiento de la asociación una vez por estudio.
+
+    Args:
+        request_data (BatchSeriesRequest): Un objeto con la lista de
+                                           `study_instance_uids` a consultar.
+
+    Returns:
+        Un BatchSeriesResponse: 'series' asocia cada StudyInstanceUID consultado con
+        éxito a su lista de SeriesResponse, y 'errors' recoge el mensaje de error de
+        los estudios cuya consulta falló (los resultados parciales se conservan).
+    """
+    if not request_data.study_instance_uids:
+        raise HTTPException(status_code=400, detail="La lista 'study_instance_uids' no puede estar vacía.")
+
+    study_uids = list(dict.fromkeys(request_data.study_instance_uids)) # Sin duplicados, conservando el orden
+    identifiers: List[DicomDataset] = []
+    for study_uid in study_uids:
+        identifier = _new_identifier("SERIES", _SERIES_RETURN_KEYS)
+        identifier.StudyInstanceUID = study_uid
+        identifiers.append(identifier)
+
+    try:
+        batch_results = await pacs_operations.perform_c_find_batch_async(
+            identifiers, PACS_CONFIG, query_model_uid='S'
+        )
+        series_by_study: Dict[str, List[Dict[str, Any]]] = {}
+        errors: Dict[str, str] = {}
+        for study_uid, results_datasets in zip(study_uids, batch_results):
+            if isinstance(results_datasets, BaseException): # Solo falló la consulta de este estudio
+                logger.warning(f"C-FIND de series fallido para el estudio {study_uid}: {results_datasets}")
+                errors[study_uid] = str(results_datasets)
+                continue
+            series_by_study[study_uid] = [
+                _series_response_from_dataset(res_ds, study_uid).model_dump() for res_ds in results_datasets
+            ]
+        return ORJSONResponse({"series": series_by_study, "errors": errors})
+    except ConnectionError as e:
+        logger.error(f"Error de conexión en C-FIND de series en lote: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail=f"Error de conexión al PACS para C-FIND: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error en C-FIND de series en lote: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error interno al consultar series en lote: {str(e)}")
+
+
 # api_main.py
 # ... (importaciones existentes, asegúrate de tener json, Tag, keyword_for_tag, tag_for_keyword, DicomDataset) ...
 
-@app.get("/studies/{study_instance_uid}/series/{series_instance_uid}/instances", response_model=List[InstanceMetadataResponse], summary="Busca metadatos de instancias vía C-FIND (DIMSE)")
+@app.get(
+    "/studies/{study_instance_uid}/series/{series_instance_uid}/instances",
+    responses={200: {"model": List[InstanceMetadataResponse], "description": "Lista JSON enviada en streaming (sin validar por FastAPI). Si el C-FIND falla a mitad del envío la conexión se aborta y el JSON queda incompleto."}},
+    summary="Busca metadatos de instancias vía C-FIND (DIMSE)")
 async def find_instances_in_series(
     study_instance_uid: str,
     series_instance_uid: str,
-    fields: Optional[List[str]] = Query(None, description="Lista de keywords DICOM o (gggg,eeee) a recuperar. E.g., 'KVP', '(0020,4000)'.")
+    fields: Optional[List[str]] = Query(None, description="Lista de keywords DICOM o (gggg,eeee) a recuperar. E.g., 'KVP', '(0020,4000)'."),
+    expand_sequences: bool = Query(False, description="Expande las secuencias (SQ) no pedidas en 'fields'. Las pedidas explícitamente se expanden siempre.")
 ):
     """
     Realiza una consulta C-FIND a nivel de imagen (IMAGE) para una serie dada.
@@ -421,10 +806,14 @@ async def find_instances_in_series(
         series_instance_uid: El UID de la serie a consultar.
         fields: Lista opcional de keywords de tags DICOM o tuplas (gggg,eeee)
                 cuyos valores se desean recuperar.
+        expand_sequences: Si es True, también se expanden las secuencias que el PACS
+                          devuelva sin haber sido pedidas en 'fields'.
 
     Returns:
-        Una lista de objetos InstanceMetadataResponse, cada uno con los
-        metadatos de una instancia.
+        Una StreamingResponse con una lista JSON de objetos InstanceMetadataResponse,
+        enviada a medida que el PACS devuelve resultados. FastAPI no valida el cuerpo
+        (el esquema en OpenAPI es solo documentación). Si la consulta falla una vez
+        iniciado el envío, la conexión se aborta y el cuerpo queda como JSON incompleto.
     """
     logger.info(f"Recibida petición C-FIND para instancias en series: {series_instance_uid}")
     logger.debug(f"Fields solicitados: {fields}")
@@ -438,56 +827,61 @@ async def find_instances_in_series(
 
     requested_tags_for_response: Dict[str, Tag] = {}
     if fields:
+        present_tags = set(identifier.keys()) # Tags ya presentes: evita consultar el Dataset en cada iteración
         for field_str in set(fields): # Usamos set para evitar procesar duplicados
             try:
-                tag_from_field = Tag(tag_for_keyword(field_str)) if ',' not in field_str else Tag(field_str)
+                tag_from_field = _resolve_tag(field_str)
+                if tag_from_field is None:
+                    logger.warning(f"Field '{field_str}' no es una keyword DICOM ni un tag (gggg,eeee) válido. Omitiendo.")
+                    continue
                 requested_tags_for_response[str(tag_from_field)] = tag_from_field
-                if tag_from_field not in identifier:
-                    setattr(identifier, keyword_for_tag(tag_from_field), "")
+                if tag_from_field not in present_tags:
+                    identifier.add_new(tag_from_field, _vr_for_tag(tag_from_field), "")
+                    present_tags.add(tag_from_field)
             except Exception as e:
                 logger.warning(f"No se pudo procesar el field '{field_str}': {e}")
 
-    logger.info(f"Identificador C-FIND final para el PACS:\n{identifier}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[find_instances_in_series] Identificador C-FIND final para el PACS:\n{identifier}")
     
-    pacs_config_dict = {
-        "PACS_IP": config.PACS_IP, "PACS_PORT": config.PACS_PORT,
-        "PACS_AET": config.PACS_AET, "AE_TITLE": config.CLIENT_AET
-    }
 
+    def _instance_json(res_ds: DicomDataset) -> bytes:
+        return orjson.dumps(InstanceMetadataResponse.model_construct(
+            SOPInstanceUID=str(res_ds.get("SOPInstanceUID", "")),
+            InstanceNumber=str(res_ds.get("InstanceNumber", "")),
+            dicom_headers=_headers_from_dataset(res_ds, requested_tags_for_response, expand_sequences)
+        ).model_dump(mode="json"))
+
+    # Las instancias se envían según llegan del PACS. Se espera a la primera antes de
+    # responder para que los errores de conexión/consulta sigan devolviendo un 500.
+    results_iter = pacs_operations.iter_c_find_async(identifier, PACS_CONFIG, query_model_uid='S')
     try:
-        results_datasets = await pacs_operations.perform_c_find_async(identifier, pacs_config_dict, query_model_uid='S')
-        response_list: List[InstanceMetadataResponse] = []
-        for res_ds in results_datasets:
-            headers: Dict[str, Any] = {}
-            tags_to_populate = requested_tags_for_response or {str(elem.tag): elem.tag for elem in res_ds}
-            
-            for tag_obj in tags_to_populate.values():
-                if tag_obj in res_ds:
-                    element = res_ds[tag_obj]
-                    key_to_use = element.keyword or str(element.tag)
-                    
-                    if element.VR == 'SQ':
-                        value_to_store = [
-                            { (item_element.keyword or str(item_element.tag)): parse_lut_explanation(item_element.value) if item_element.tag == Tag(0x0028,0x3003) else (str(item_element.value) if item_element.value is not None else None) for item_element in item_dataset }
-                            for item_dataset in element.value
-                        ]
-                    elif isinstance(element.value, MultiValue):
-                        value_to_store = [str(v) for v in element.value]
-                    else:
-                        value_to_store = str(element.value) if element.value is not None else ""
-                    
-                    headers[key_to_use] = value_to_store
-
-            response_list.append(InstanceMetadataResponse(
-                SOPInstanceUID=res_ds.get("SOPInstanceUID", ""),
-                InstanceNumber=str(res_ds.get("InstanceNumber", "")),
-                dicom_headers=headers
-            ))
-        return response_list
+        first_ds: Optional[DicomDataset] = await results_iter.__anext__()
+    except StopAsyncIteration:
+        first_ds = None
     except Exception as e:
         logger.error(f"Error en C-FIND de instancias: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error interno del servidor durante la consulta C-FIND: {str(e)}")
 
+    async def _stream_instances():
+        if first_ds is None:
+            yield b"[]"
+            return
+        try:
+            yield b"[" + _instance_json(first_ds)
+            async for res_ds in results_iter:
+                yield b"," + _instance_json(res_ds)
+            yield b"]"
+        except Exception as e:
+            # El estado 200 ya se envió: se relanza para que el servidor aborte la conexión y
+            # el cliente reciba un JSON incompleto, nunca una lista que parezca completa
+            logger.error(f"Error en C-FIND de instancias durante el streaming: {e}", exc_info=True)
+            raise
+        finally:
+            await results_iter.aclose()
+
+    return StreamingResponse(_stream_instances(), media_type="application/json")
+
 # ... (resto de tus endpoints, como /retrieve-instance, /retrieve-multiple-instances, /retrieved-instances/.../pixeldata)
 
 # --- Endpoints para C-MOVE ---
@@ -531,31 +925,16 @@ async def retrieve_instance_via_cmove(item: MoveRequest): # Usa el modelo MoveRe
 
     logger.info(f"Solicitud C-MOVE para: QueryLevel='{identifier.QueryRetrieveLevel}', StudyUID='{identifier.StudyInstanceUID}', SeriesUID='{identifier.get('SeriesInstanceUID', 'N/A')}', SOPInstanceUID='{identifier.get('SOPInstanceUID', 'N/A')}'")
 
-    pacs_config_dict = {
-        "PACS_IP": config.PACS_IP, "PACS_PORT": config.PACS_PORT,
-        "PACS_AET": config.PACS_AET, "AE_TITLE": config.CLIENT_AET 
-    }
     move_destination = config.API_SCP_AET
     try:
         move_responses = await pacs_operations.perform_c_move_async(
-            identifier, pacs_config_dict, move_destination_aet=move_destination, query_model_uid='S' # Asume Study Root
+            identifier, PACS_CONFIG, move_destination_aet=move_destination, query_model_uid='S' # Asume Study Root
         )
         
         # Interpretar la respuesta C-MOVE
         # La lista move_responses contiene tuplas de (status_dataset, identifier_dataset)
         # El último status_dataset es el que indica el estado final de la operación C-MOVE general.
-        final_status_ds = None
-        num_completed = 0
-        num_failed = 0
-        num_warning = 0
-
-        if move_responses:
-            for status_ds_item, _ in move_responses: # Iterar para obtener el último estado y contadores
-                if status_ds_item:
-                    final_status_ds = status_ds_item
-                    num_completed = status_ds_item.get("NumberOfCompletedSuboperations", num_completed)
-                    num_failed = status_ds_item.get("NumberOfFailedSuboperations", num_failed)
-                    num_warning = status_ds_item.get("NumberOfWarningSuboperations", num_warning)
+        final_status_ds, num_completed, num_failed, num_warning = _final_move_status(move_responses)
         
         if final_status_ds and hasattr(final_status_ds, 'Status'):
             status_val = final_status_ds.Status
@@ -588,8 +967,8 @@ async def retrieve_multiple_instances_via_cmove(request_data: BulkMoveRequest):
     """
     Inicia múltiples operaciones DICOM C-MOVE para una lista de instancias específicas.
 
-    Itera sobre la lista de instancias proporcionada y solicita al PACS que mueva
-    cada una de ellas al C-STORE SCP de esta API.
+    Agrupa las instancias por serie y solicita al PACS que mueva cada una de ellas
+    al C-STORE SCP de esta API, reutilizando una única asociación por serie.
 
     Args:
         request_data (BulkMoveRequest): Un objeto que contiene una lista de
@@ -598,81 +977,84 @@ async def retrieve_multiple_instances_via_cmove(request_data: BulkMoveRequest):
     Returns:
         Un resumen de los resultados para cada una de las operaciones C-MOVE.
     """
-    pacs_config_dict = {
-        "PACS_IP": config.PACS_IP,
-        "PACS_PORT": config.PACS_PORT,
-        "PACS_AET": config.PACS_AET,
-        "AE_TITLE": config.CLIENT_AET
-    }
     move_destination_aet = config.API_SCP_AET
-    responses_summary = []
     
     if not request_data.instances_to_move:
         raise HTTPException(status_code=400, detail="La lista 'instances_to_move' no puede estar vacía.")
 
-    for instance_info in request_data.instances_to_move:
-        identifier = DicomDataset()
-        identifier.QueryRetrieveLevel = "IMAGE"
-        identifier.StudyInstanceUID = instance_info.study_instance_uid
-        identifier.SeriesInstanceUID = instance_info.series_instance_uid
-        identifier.SOPInstanceUID = instance_info.sop_instance_uid
-        
-        instance_response_summary = {
-            "study_instance_uid": instance_info.study_instance_uid,
-            "series_instance_uid": instance_info.series_instance_uid,
-            "sop_instance_uid": instance_info.sop_instance_uid,
-            "status_code_hex": "N/A",
-            "message": "No procesado",
-            "sub_operations_completed": 0,
-            "sub_operations_failed": 0,
-            "sub_operations_warning": 0
-        }
+    responses_summary: List[Optional[CMoveInstanceResult]] = [None] * len(request_data.instances_to_move)
+
+    # Agrupar las instancias por serie: cada serie usa una única asociación para
+    # todos sus C-MOVE, en lugar de una asociación por instancia.
+    instances_by_series: Dict[Tuple[str, str], List[Tuple[int, Any]]] = defaultdict(list)
+    for index, instance_info in enumerate(request_data.instances_to_move):
+        instances_by_series[(instance_info.study_instance_uid, instance_info.series_instance_uid)].append((index, instance_info))
+
+    async def _move_series(series_instances: List[Tuple[int, Any]], semaphore: asyncio.Semaphore) -> List[Union[List[Tuple[DicomDataset, Optional[DicomDataset]]], Exception]]:
+        identifiers: List[DicomDataset] = []
+        for _, instance_info in series_instances:
+            identifier = DicomDataset()
+            identifier.QueryRetrieveLevel = "IMAGE"
+            identifier.StudyInstanceUID = instance_info.study_instance_uid
+            identifier.SeriesInstanceUID = instance_info.series_instance_uid
+            identifier.SOPInstanceUID = instance_info.sop_instance_uid
+            identifiers.append(identifier)
+
+        async with semaphore:
+            logger.info(f"Iniciando {len(identifiers)} C-MOVE para la serie {series_instances[0][1].series_instance_uid} hacia {move_destination_aet}")
+            return await pacs_operations.perform_c_move_batch_async(
+                identifiers, PACS_CONFIG, move_destination_aet=move_destination_aet, query_model_uid='S'
+            )
 
-        try:
-            logger.info(f"Iniciando C-MOVE para SOPInstanceUID: {instance_info.sop_instance_uid} hacia {move_destination_aet}")
-            move_responses_single = await pacs_operations.perform_c_move_async(
-                identifier, pacs_config_dict, move_destination_aet=move_destination_aet, query_model_uid='S'
+    # Las series se mueven en paralelo, limitando las asociaciones simultáneas con el PACS.
+    # Con return_exceptions=True el fallo de una serie no cancela las demás.
+    series_groups = list(instances_by_series.values())
+    semaphore = asyncio.Semaphore(config.MAX_CMOVE_CONCURRENCY)
+    batch_results = await asyncio.gather(
+        *(_move_series(series_instances, semaphore) for series_instances in series_groups),
+        return_exceptions=True
+    )
+
+    for series_instances, batch_result in zip(series_groups, batch_results):
+        for position, (index, instance_info) in enumerate(series_instances):
+            instance_result = CMoveInstanceResult(
+                study_instance_uid=instance_info.study_instance_uid,
+                series_instance_uid=instance_info.series_instance_uid,
+                sop_instance_uid=instance_info.sop_instance_uid
             )
-            
-            final_status_ds_single = None
-            num_completed_single = 0
-            num_failed_single = 0
-            num_warning_single = 0
-
-            if move_responses_single:
-                for status_ds_item, _ in move_responses_single:
-                    if status_ds_item:
-                        final_status_ds_single = status_ds_item
-                        num_completed_single = status_ds_item.get("NumberOfCompletedSuboperations", num_completed_single)
-                        num_failed_single = status_ds_item.get("NumberOfFailedSuboperations", num_failed_single)
-                        num_warning_single = status_ds_item.get("NumberOfWarningSuboperations", num_warning_single)
-
-            instance_response_summary["sub_operations_completed"] = num_completed_single
-            instance_response_summary["sub_operations_failed"] = num_failed_single
-            instance_response_summary["sub_operations_warning"] = num_warning_single
+            responses_summary[index] = instance_result
+
+            # Error de toda la serie (p. ej. sin asociación) o solo de esta instancia
+            # gather(return_exceptions=True) también puede devolver BaseException (p. ej. CancelledError)
+            instance_outcome = batch_result if isinstance(batch_result, BaseException) else batch_result[position]
+            if isinstance(instance_outcome, ConnectionError):
+                logger.error(f"Error de conexión durante C-MOVE para {instance_info.sop_instance_uid}: {instance_outcome}")
+                instance_result.message = f"Error de conexión: {str(instance_outcome)}"
+                instance_result.status_code_hex = "CONN_ERROR"
+                continue
+            if isinstance(instance_outcome, BaseException):
+                logger.error(f"Error genérico durante C-MOVE para {instance_info.sop_instance_uid}: {instance_outcome}")
+                instance_result.message = f"Error interno del servidor: {str(instance_outcome)}"
+                instance_result.status_code_hex = "SERVER_ERROR"
+                continue
+
+            final_status_ds_single, num_completed_single, num_failed_single, num_warning_single = _final_move_status(instance_outcome)
+
+            instance_result.sub_operations_completed = num_completed_single
+            instance_result.sub_operations_failed = num_failed_single
+            instance_result.sub_operations_warning = num_warning_single
 
             if final_status_ds_single and hasattr(final_status_ds_single, 'Status'):
                 status_val_single = final_status_ds_single.Status
-                instance_response_summary["status_code_hex"] = f"0x{status_val_single:04X}"
-                instance_response_summary["message"] = f"Estado final del PACS: 0x{status_val_single:04X}."
+                instance_result.status_code_hex = f"0x{status_val_single:04X}"
+                instance_result.message = f"Estado final del PACS: 0x{status_val_single:04X}."
                 if status_val_single == 0x0000:
                     logger.info(f"C-MOVE para {instance_info.sop_instance_uid} exitoso.")
                 else:
                     logger.warning(f"C-MOVE para {instance_info.sop_instance_uid} con estado {status_val_single:#04X}.")
             else:
-                instance_response_summary["message"] = f"No se recibió estado final claro del PACS para {instance_info.sop_instance_uid}."
-                logger.error(instance_response_summary["message"])
-
-        except ConnectionError as e_conn:
-            logger.error(f"Error de conexión durante C-MOVE para {instance_info.sop_instance_uid}: {e_conn}", exc_info=True)
-            instance_response_summary["message"] = f"Error de conexión: {str(e_conn)}"
-            instance_response_summary["status_code_hex"] = "CONN_ERROR"
-        except Exception as e_generic:
-            logger.error(f"Error genérico durante C-MOVE para {instance_info.sop_instance_uid}: {e_generic}", exc_info=True)
-            instance_response_summary["message"] = f"Error interno del servidor: {str(e_generic)}"
-            instance_response_summary["status_code_hex"] = "SERVER_ERROR"
-        
-        responses_summary.append(instance_response_summary)
+                instance_result.message = f"No se recibió estado final claro del PACS para {instance_info.sop_instance_uid}."
+                logger.error(instance_result.message)
 
     return {
         "message": "Procesamiento de C-MOVE masivo completado. Revise los resultados individuales.",
@@ -680,8 +1062,249 @@ async def retrieve_multiple_instances_via_cmove(request_data: BulkMoveRequest):
     }
 
 
+# Directorio de recepción del SCP. config.DICOM_RECEIVED_DIR puede ser str: se convierte una vez.
+_RECEIVED_DIR = Path(config.DICOM_RECEIVED_DIR)
+
+# Tags del módulo Image Pixel que deben acompañar a PixelData
+_ROWS_TAG = Tag(0x0028, 0x0010)
+_COLUMNS_TAG = Tag(0x0028, 0x0011)
+# Únicos tags de cabecera que necesitan los endpoints de píxeles
+_IMAGE_HEADER_TAGS = [
+    _ROWS_TAG, _COLUMNS_TAG,
+    Tag(0x0028, 0x0002), # SamplesPerPixel
+    Tag(0x0028, 0x0008), # NumberOfFrames
+    Tag(0x0028, 0x0100), # BitsAllocated
+    Tag(0x0028, 0x0103), # PixelRepresentation
+]
+
+# Cachés de ficheros recibidos, con clave (ruta, mtime_ns, tamaño): si el SCP sobrescribe
+# un fichero cambian su mtime/tamaño y la entrada antigua deja de usarse.
+@functools.lru_cache(maxsize=256)
+def _cached_header(filepath_str: str, mtime_ns: int, size: int) -> Tuple[int, int, int, int, int, int]:
+    """
+    Lee (y cachea) los datos de imagen de la cabecera de un fichero DICOM, sin PixelData.
+
+    Returns:
+        Tupla (Rows, Columns, SamplesPerPixel, NumberOfFrames, BitsAllocated,
+        PixelRepresentation). Solo se cachean estos enteros, no el Dataset completo.
+    """
+    # specific_tags: el resto de elementos (secuencias privadas, SR...) se salta sin crear DataElements
+    ds = pydicom.dcmread(filepath_str, force=True, stop_before_pixels=True, specific_tags=_IMAGE_HEADER_TAGS)
+    # Sin Rows/Columns no hay módulo Image Pixel: se descarta sin intentar decodificar
+    if _ROWS_TAG not in ds or _COLUMNS_TAG not in ds:
+        raise HTTPException(status_code=404, detail="El objeto DICOM no contiene datos de píxeles (PixelData) válidos.")
+    return (
+        int(ds.Rows),
+        int(ds.Columns),
+        int(ds.get("SamplesPerPixel", 1)),
+        int(ds.get("NumberOfFrames", 1) or 1),
+        int(ds.get("BitsAllocated", 16)),
+        int(ds.get("PixelRepresentation", 0)),
+    )
+
+def _header_pixel_dtype(bits_allocated: int, pixel_representation: int) -> str:
+    """Tipo numpy que usaría pydicom para los píxeles, deducido de la cabecera (sin decodificar)."""
+    bits = 8 if bits_allocated <= 8 else bits_allocated # BitsAllocated 1 (bit-packed) se devuelve como uint8
+    return f"{'u' if pixel_representation == 0 else ''}int{bits}"
+
+@functools.lru_cache(maxsize=8) # Pocos frames: pueden ocupar mucha memoria
+def _cached_first_frame(filepath_str: str, mtime_ns: int, size: int):
+    """Decodifica (y cachea) el primer frame de un fichero DICOM."""
+    # Mapeo de solo lectura: el SO pagina únicamente la cabecera y los bytes del frame 0
+    with open(filepath_str, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        frame = pixel_array(mm, index=0) # Devuelve un array propio: no referencia al mapeo
+    frame.setflags(write=False) # Compartido entre peticiones: solo lectura
+    return frame
+
+# Caché persistente de vistas previas: una fila por SOPInstanceUID con la respuesta ya
+# serializada. Si el fichero cambia (mtime_ns/tamaño) la fila se ignora y se reemplaza.
+# Versión del formato de las filas: cambia sola si cambia el esquema de PixelDataResponse
+# (p. ej. campos nuevos), de modo que las filas de versiones anteriores se tratan como fallo
+_PREVIEW_CACHE_VERSION = hashlib.sha1(
+    orjson.dumps(PixelDataResponse.model_json_schema(), option=orjson.OPT_SORT_KEYS)
+).hexdigest()[:16]
+
+_preview_db: Optional[sqlite3.Connection] = None
+_preview_db_lock = threading.Lock() # La conexión se comparte entre los hilos de to_thread
+
+def _get_preview_db() -> Optional[sqlite3.Connection]:
+    """Abre (una sola vez) la base de datos de la caché de vistas previas; None si está desactivada."""
+    global _preview_db
+    if _preview_db is None and config.PREVIEW_CACHE_DB:
+        Path(config.PREVIEW_CACHE_DB).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(config.PREVIEW_CACHE_DB, check_same_thread=False)
+        # La tabla sin versión de versiones anteriores no se puede validar: se descarta
+        conn.execute("DROP TABLE IF EXISTS previews")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS preview_cache ("
+            "sop_instance_uid TEXT PRIMARY KEY, cache_version TEXT NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, response BLOB NOT NULL)"
+        )
+        conn.commit()
+        _preview_db = conn
+    return _preview_db
+
+def _load_cached_preview(sop_instance_uid: str, st: os.stat_result) -> Optional[PixelDataResponse]:
+    """Devuelve la vista previa persistida si corresponde a la versión actual del fichero."""
+    try:
+        with _preview_db_lock:
+            conn = _get_preview_db()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT response FROM preview_cache WHERE sop_instance_uid = ? AND cache_version = ? AND mtime_ns = ? AND size = ?",
+                (sop_instance_uid, _PREVIEW_CACHE_VERSION, st.st_mtime_ns, st.st_size)
+            ).fetchone()
+        if row is None:
+            return None
+        return PixelDataResponse.model_validate_json(row[0])
+    except (sqlite3.Error, OSError, ValidationError) as e:
+        # Una fila corrupta o ilegible se trata como fallo de caché, nunca como error 500
+        logger.warning(f"No se pudo leer la caché de vistas previas: {e}")
+        return None
+
+def _store_cached_preview(sop_instance_uid: str, st: os.stat_result, response: PixelDataResponse) -> None:
+    """Persiste la vista previa, reemplazando la de una versión anterior del mismo fichero."""
+    try:
+        with _preview_db_lock:
+            conn = _get_preview_db()
+            if conn is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO preview_cache (sop_instance_uid, cache_version, mtime_ns, size, response) VALUES (?, ?, ?, ?, ?)",
+                (sop_instance_uid, _PREVIEW_CACHE_VERSION, st.st_mtime_ns, st.st_size, orjson.dumps(response.model_dump()))
+            )
+            conn.commit()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"No se pudo guardar la vista previa en caché: {e}")
+
+def _close_preview_db() -> None:
+    """Cierra la conexión de la caché de vistas previas (al apagar la aplicación)."""
+    global _preview_db
+    with _preview_db_lock:
+        if _preview_db is not None:
+            _preview_db.close()
+            _preview_db = None
+
+def _stat_received_file(filepath: Path) -> os.stat_result:
+    """
+    Obtiene el stat de un fichero recibido sin seguir enlaces simbólicos.
+
+    Raises:
+        HTTPException: 404 si no existe; 400 si es un enlace simbólico o no es un fichero regular.
+    """
+    try:
+        st = os.stat(filepath, follow_symlinks=False)
+    except OSError:
+        logger.warning(f"Archivo DICOM no encontrado en el directorio de recepción: {filepath}")
+        raise HTTPException(status_code=404, detail="Archivo DICOM no encontrado. Es posible que C-MOVE no haya completado, fallado, o aún no haya llegado.")
+    if not stat.S_ISREG(st.st_mode):
+        logger.warning(f"Ruta en el directorio de recepción que no es un fichero regular: {filepath}")
+        raise HTTPException(status_code=400, detail="El archivo solicitado no es un archivo DICOM regular.")
+    return st
+
+def _preview_mono(frame: np.ndarray) -> np.ndarray:
+    """Esquina 5x5 de un frame monocromo (filas, cols)."""
+    return frame[:5, :5]
+
+def _preview_color(frame: np.ndarray) -> np.ndarray:
+    """Esquina 5x5 del primer canal (ej. Rojo) de un frame en color."""
+    # pydicom devuelve siempre (filas, cols, samples), sea cual sea PlanarConfiguration
+    return frame[:5, :5, 0]
+
+# Vista previa según (ndim del frame, ¿color?): una búsqueda en vez de la cadena de if/elif
+_PREVIEW_SLICERS: Dict[Tuple[int, bool], Callable[[np.ndarray], np.ndarray]] = {
+    (2, False): _preview_mono,
+    (3, True): _preview_color,
+}
+
+def _read_pixel_preview(filepath: Path, sop_instance_uid: str, st: os.stat_result, with_preview: bool = True) -> PixelDataResponse:
+    """
+    Lee un fichero DICOM recibido y construye la respuesta con la vista previa de píxeles.
+
+    Función bloqueante (disco y decodificación): se ejecuta en un hilo desde el endpoint.
+
+    Args:
+        filepath: Ruta al fichero DICOM almacenado localmente.
+        sop_instance_uid: El SOP Instance UID de la instancia.
+        st: Resultado de _stat_received_file; mtime_ns y tamaño forman parte de la clave de caché.
+        with_preview: Si es False solo se lee la cabecera: forma y tipo se deducen de
+            sus tags y no se decodifica ningún frame.
+
+    Returns:
+        Un objeto PixelDataResponse con la forma, tipo de dato y vista previa del array.
+    """
+    filepath_str = str(filepath) # dcmread necesita string
+
+    if not with_preview:
+        rows, columns, samples_per_pixel, number_of_frames, bits_allocated, pixel_representation = _cached_header(
+            filepath_str, st.st_mtime_ns, st.st_size
+        )
+        # Convención de pydicom: (frames, filas, cols, samples), sin los ejes de tamaño 1
+        header_shape = ((number_of_frames,) if number_of_frames > 1 else ()) + (rows, columns) + ((samples_per_pixel,) if samples_per_pixel > 1 else ())
+        return PixelDataResponse(
+            sop_instance_uid=sop_instance_uid,
+            rows=rows,
+            columns=columns,
+            pixel_array_shape=header_shape,
+            pixel_array_dtype=_header_pixel_dtype(bits_allocated, pixel_representation),
+            pixel_array_preview=None,
+            message="Pixel data metadata read from the locally stored C-MOVE file header. No preview requested."
+        )
+
+    cached_response = _load_cached_preview(sop_instance_uid, st)
+    if cached_response is not None: # Sin dcmread ni decodificación
+        return cached_response
+    
+    # Solo la cabecera: los píxeles se decodifican aparte y únicamente el primer frame
+    rows, columns, samples_per_pixel, number_of_frames, _, _ = _cached_header(filepath_str, st.st_mtime_ns, st.st_size)
+
+    try:
+        # Decodifica solo el frame 0 leyendo desde el fichero (sin cargar el resto de frames)
+        frame_array = _cached_first_frame(filepath_str, st.st_mtime_ns, st.st_size)
+    except AttributeError:
+        raise HTTPException(status_code=404, detail="El objeto DICOM no contiene datos de píxeles (PixelData) válidos.")
+
+    # Forma del array completo según la convención de pydicom: (frames, filas, cols[, samples])
+    pixel_array_shape = frame_array.shape if number_of_frames == 1 else (number_of_frames, *frame_array.shape)
+    logger.info(f"Frame 0 obtenido del archivo {filepath}: forma={pixel_array_shape}, tipo={frame_array.dtype}")
+    
+    preview = None
+    preview_buffer_b64: Optional[str] = None
+    preview_buffer_shape: Optional[Tuple[int, ...]] = None
+    # Crear un preview más pequeño para evitar enviar arrays muy grandes en JSON
+    preview_slicer = _PREVIEW_SLICERS.get((frame_array.ndim, samples_per_pixel > 1))
+    if preview_slicer is not None and frame_array.size > 0:
+        # Copia contigua de como mucho 5x5 elementos: tolist() nunca recorre el frame completo.
+        # Se guardan ambos formatos (la caché sirve a los dos); el endpoint envía solo uno
+        preview_corner = np.ascontiguousarray(preview_slicer(frame_array))
+        preview = preview_corner.tolist()
+        # Buffer crudo: una sola copia en C, sin un objeto Python por píxel
+        preview_buffer_b64 = base64.b64encode(preview_corner.tobytes()).decode("ascii")
+        preview_buffer_shape = preview_corner.shape
+
+    response = PixelDataResponse(
+        sop_instance_uid=sop_instance_uid,
+        rows=rows,
+        columns=columns,
+        pixel_array_shape=pixel_array_shape,
+        pixel_array_dtype=str(frame_array.dtype),
+        pixel_array_preview=preview,
+        preview_buffer_b64=preview_buffer_b64,
+        preview_buffer_shape=preview_buffer_shape,
+        message="Pixel data accessed from locally stored C-MOVE file. Preview shown."
+    )
+    _store_cached_preview(sop_instance_uid, st, response)
+    return response
+
 @app.get("/retrieved-instances/{sop_instance_uid}/pixeldata", response_model=PixelDataResponse, summary="Obtiene datos de píxeles de una instancia recibida localmente")
-async def get_retrieved_instance_pixeldata(sop_instance_uid: str):
+async def get_retrieved_instance_pixeldata(
+    sop_instance_uid: str,
+    request: Request,
+    response: Response,
+    preview: bool = Query(True, description="Si es false solo se lee la cabecera (sin decodificar píxeles)"),
+    preview_buffer: bool = Query(config.PIXEL_PREVIEW_AS_BUFFER, description="Si es true la vista previa se envía como buffer crudo en base64 (preview_buffer_b64) en lugar de la lista pixel_array_preview")
+):
     """
     Recupera los datos de píxeles de un archivo DICOM almacenado localmente.
 
@@ -690,6 +1313,15 @@ async def get_retrieved_instance_pixeldata(sop_instance_uid: str):
 
     Args:
         sop_instance_uid: El SOP Instance UID del fichero DICOM a procesar.
+        request: La petición; si su cabecera Accept incluye application/x-msgpack
+            (y msgpack está instalado) la respuesta se serializa con MessagePack. Si su
+            If-None-Match coincide con el ETag del fichero se responde 304 sin leerlo.
+        response: Respuesta en curso, para añadir las cabeceras ETag y Vary.
+        preview: Si es False, la forma y el tipo se deducen de la cabecera y no se
+            decodifica ningún frame.
+        preview_buffer: Formato de la vista previa en JSON: buffer crudo en base64 o lista
+            anidada (por defecto config.PIXEL_PREVIEW_AS_BUFFER). Solo se envía uno de los dos;
+            en MessagePack siempre viaja como binario.
 
     Returns:
         Un objeto PixelDataResponse que contiene la forma, tipo de dato y
@@ -697,61 +1329,109 @@ async def get_retrieved_instance_pixeldata(sop_instance_uid: str):
     """
     # Validar el SOPInstanceUID para evitar traversal attacks, aunque join lo mitiga.
     # Un UID válido no debería contener '..' o '/'.
-    if not re.fullmatch(r"[0-9\.]+", sop_instance_uid): # Patrón simple para UIDs DICOM
+    if not is_valid_uid(sop_instance_uid):
         raise HTTPException(status_code=400, detail="SOPInstanceUID con formato inválido.")
 
-    # Usar config.DICOM_RECEIVED_DIR que es un Path object
-    filepath = config.DICOM_RECEIVED_DIR / (sop_instance_uid + ".dcm")
+    filepath = _RECEIVED_DIR / (sop_instance_uid + ".dcm")
     logger.info(f"[get_retrieved_instance_pixeldata] Buscando archivo: {filepath}")
 
-    if not filepath.is_file(): # Usar el método de Path
-        logger.warning(f"Archivo DICOM no encontrado en el directorio de recepción: {filepath}")
-        raise HTTPException(status_code=404, detail="Archivo DICOM no encontrado. Es posible que C-MOVE no haya completado, fallado, o aún no haya llegado.")
-    
+    use_msgpack = msgpack is not None and _MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
     try:
-        ds = pydicom.dcmread(str(filepath), force=True) # dcmread necesita string
-        if not hasattr(ds, 'PixelData') or ds.PixelData is None:
-            raise HTTPException(status_code=404, detail="El objeto DICOM no contiene datos de píxeles (PixelData) válidos.")
-        
-        pixel_array = ds.pixel_array # Esto puede tardar y consumir memoria para imágenes grandes
-        logger.info(f"Array de píxeles obtenido del archivo {filepath}: forma={pixel_array.shape}, tipo={pixel_array.dtype}")
-        
-        preview = None
-        # Crear un preview más pequeño para evitar enviar arrays muy grandes en JSON
-        if pixel_array.ndim >= 2 and pixel_array.size > 0:
-            # Para imágenes 2D (monocromo o un frame de color)
-            if pixel_array.ndim == 2:
-                rows_preview = min(pixel_array.shape[0], 5)
-                cols_preview = min(pixel_array.shape[1], 5)
-                preview = pixel_array[:rows_preview, :cols_preview].tolist()
-            # Para imágenes 3D (multiframe monocromo o RGB)
-            elif pixel_array.ndim == 3:
-                # Asumimos primer frame para preview si es multiframe monocromo
-                # o un plano si es color (ej. pixel_array[0] sería el plano R si es (planos, filas, cols))
-                # pydicom.pixel_array maneja esto y devuelve (filas, cols) o (filas, cols, samples) o (frames, filas, cols)
-                # Si es (frames, filas, cols)
-                if ds.get("SamplesPerPixel", 1) == 1: # Monocromo multiframe
-                     rows_preview = min(pixel_array.shape[1], 5)
-                     cols_preview = min(pixel_array.shape[2], 5)
-                     preview = pixel_array[0, :rows_preview, :cols_preview].tolist() # Preview del primer frame
-                # Si es (filas, cols, samples) -> color
-                elif ds.get("SamplesPerPixel", 1) > 1 and pixel_array.shape[-1] == ds.SamplesPerPixel:
-                     rows_preview = min(pixel_array.shape[0], 5)
-                     cols_preview = min(pixel_array.shape[1], 5)
-                     preview = pixel_array[:rows_preview, :cols_preview, 0].tolist() # Preview del primer canal (ej. Rojo)
+        st = await asyncio.to_thread(_stat_received_file, filepath)
+        # ETag débil por versión del fichero y representación (con/sin preview, JSON lista/buffer o MessagePack)
+        representation = "m" if use_msgpack else ("b" if preview_buffer else "j")
+        etag = f'W/"{st.st_mtime_ns:x}-{st.st_size:x}-{"p" if preview else "h"}{representation}"'
+        cache_headers = {"ETag": etag, "Vary": "Accept"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=cache_headers) # Sin dcmread ni decodificación
+
+        # Lectura de disco y decodificación fuera del event loop
+        pixel_response = await asyncio.to_thread(_read_pixel_preview, filepath, sop_instance_uid, st, preview)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error procesando archivo DICOM almacenado {filepath}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error interno al procesar archivo DICOM almacenado: {str(e)}")
+
+    if use_msgpack:
+        # En MessagePack la vista previa viaja como binario (bytes C-contiguos + shape + dtype),
+        # sin la lista anidada ni el base64 de la respuesta JSON
+        payload = pixel_response.model_dump(exclude={"pixel_array_preview", "preview_buffer_b64"})
+        b64 = pixel_response.preview_buffer_b64
+        payload["preview_buffer"] = base64.b64decode(b64) if b64 is not None else None
+        return Response(content=msgpack.packb(payload, use_bin_type=True), media_type=_MSGPACK_MEDIA_TYPE, headers=cache_headers)
+    response.headers.update(cache_headers)
+    # Solo el formato pedido: la vista previa no se duplica en la respuesta
+    if preview_buffer:
+        return pixel_response.model_copy(update={"pixel_array_preview": None})
+    return pixel_response.model_copy(update={"preview_buffer_b64": None, "preview_buffer_shape": None})
+
+def _frame_corner(frame: np.ndarray) -> bytes:
+    """Esquina 5x5 de un frame (primer canal si es color) serializada como JSON."""
+    corner = _preview_mono(frame) if frame.ndim == 2 else _preview_color(frame)
+    return orjson.dumps(np.ascontiguousarray(corner).tolist())
+
+@app.get("/retrieved-instances/{sop_instance_uid}/frame-previews", response_class=StreamingResponse, summary="Vista previa 5x5 de cada frame de una instancia recibida localmente (streaming)")
+async def stream_retrieved_instance_frame_previews(
+    sop_instance_uid: str,
+    max_frames: int = Query(16, ge=1, le=1000, description="Número máximo de frames a previsualizar")
+):
+    """
+    Devuelve la esquina 5x5 de los primeros frames de un fichero DICOM recibido.
 
+    Los frames se decodifican de uno en uno (pydicom.pixels.iter_pixels) y cada
+    vista previa se envía según se obtiene, así que en memoria solo hay un frame
+    a la vez. La respuesta tiene la forma `{"frames": [[[...]], ...]}`.
 
-        return PixelDataResponse(
-            sop_instance_uid=sop_instance_uid,
-            rows=ds.Rows,
-            columns=ds.Columns,
-            pixel_array_shape=pixel_array.shape,
-            pixel_array_dtype=str(pixel_array.dtype),
-            pixel_array_preview=preview,
-            message="Pixel data accessed from locally stored C-MOVE file. Preview shown."
-        )
+    Args:
+        sop_instance_uid: El SOP Instance UID del fichero DICOM a procesar.
+        max_frames: Número máximo de frames a incluir.
+
+    Returns:
+        Un StreamingResponse JSON con una vista previa por frame.
+    """
+    if not is_valid_uid(sop_instance_uid):
+        raise HTTPException(status_code=400, detail="SOPInstanceUID con formato inválido.")
+
+    filepath = _RECEIVED_DIR / (sop_instance_uid + ".dcm")
+    await asyncio.to_thread(_stat_received_file, filepath)
+
+    frames = iter_pixels(str(filepath))
+
+    def _next_corner() -> Optional[bytes]:
+        frame = next(frames, None)
+        return None if frame is None else _frame_corner(frame)
+
+    # El primer frame se decodifica antes de responder para que los errores den 404/500
+    try:
+        first_chunk = await asyncio.to_thread(_next_corner)
+    except AttributeError:
+        frames.close()
+        raise HTTPException(status_code=404, detail="El objeto DICOM no contiene datos de píxeles (PixelData) válidos.")
     except Exception as e:
+        frames.close()
         logger.error(f"Error procesando archivo DICOM almacenado {filepath}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error interno al procesar archivo DICOM almacenado: {str(e)}")
 
+    async def _stream_previews():
+        try:
+            yield b'{"frames":['
+            chunk, sent = first_chunk, 0
+            while chunk is not None:
+                yield chunk if sent == 0 else b"," + chunk
+                sent += 1
+                if sent >= max_frames:
+                    break
+                chunk = await asyncio.to_thread(_next_corner) # Decodificación fuera del event loop
+            yield b"]}"
+        except Exception as e:
+            # La respuesta ya está en curso: solo se puede registrar el error y cortar el stream
+            logger.error(f"Error decodificando frames de {filepath} durante el streaming: {e}", exc_info=True)
+            raise
+        finally:
+            frames.close() # Cierra el fichero abierto por iter_pixels
+
+    return StreamingResponse(_stream_previews(), media_type="application/json")
+
 # --- Fin de api_main.py ---
\ No newline at end of file
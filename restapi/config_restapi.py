@@ -41,10 +41,30 @@ PACS_AET = "DCM4CHEE"              # AE Title del servidor PACS (destino)
 API_SCP_AET = "FASTAPI_SCP"  # AE Title de tu API como receptor C-STORE
 API_SCP_PORT = 11115         # Puerto donde escuchará tu API (ejemplo)
 DICOM_RECEIVED_DIR = "./dicom_received" # Directorio para guardar imágenes recibidas
+# Segundos que el SCP espera a que terminen los C-STORE en curso al apagar la aplicación
+SCP_SHUTDOWN_TIMEOUT = 10.0
 
 # Configuración del Cliente AE (para nuestra API cuando actúa como SCU)
 CLIENT_AET = "FASTAPI_CLIENT"
 
+# Número máximo de asociaciones C-MOVE simultáneas abiertas contra el PACS
+# en las peticiones de movimiento masivo (una asociación por serie).
+MAX_CMOVE_CONCURRENCY = 4
+
+# Caché persistente (SQLite) de las vistas previas de píxeles de los ficheros recibidos.
+# Sobrevive a reinicios de la API; None la desactiva.
+PREVIEW_CACHE_DB = str(Path(DICOM_RECEIVED_DIR) / ".preview_cache.sqlite")
+
+# Valores DS/IS en los dicom_headers de las instancias: True los devuelve como texto
+# (formato histórico); False como números JSON (int/float), sin crear un str por valor.
+HEADERS_NUMERIC_AS_STRING = True
+
+# Formato por defecto de la vista previa de /retrieved-instances/{uid}/pixeldata (el cliente
+# puede elegir con ?preview_buffer=): False envía la lista anidada pixel_array_preview
+# (formato histórico); True el buffer crudo en base64 (preview_buffer_b64 + preview_buffer_shape).
+# Nunca se envían ambos.
+PIXEL_PREVIEW_AS_BUFFER = False
+
 
 # --- Configuración de Logging ---
 # Puedes definir el nivel de logging global aquí
@@ -1,6 +1,8 @@
 # dicom_scp.py
 import os
 import logging
+import tempfile
+import time
 # Usando el bloque de importación que has confirmado que funciona
 from pynetdicom import AE, evt, AllStoragePresentationContexts, ALL_TRANSFER_SYNTAXES
 from pynetdicom.sop_class import Verification
@@ -14,6 +16,7 @@ except ModuleNotFoundError:
         API_SCP_AET = "TEST_SCP_DIRECT"
         API_SCP_PORT = 11115
         DICOM_RECEIVED_DIR = "dicom_received_test_direct"
+        SCP_SHUTDOWN_TIMEOUT = 10.0
     config = ConfigMock()
     print("ADVERTENCIA: Usando configuración mock para dicom_scp.py.")
 
@@ -30,6 +33,26 @@ except Exception as e:
     logger.error(f"No se pudo crear el directorio de recepción DICOM: {e}")
 
 
+def _save_atomically(ds, filepath: str) -> None:
+    """
+    Guarda el dataset en un temporal del mismo directorio y lo renombra a su nombre final.
+
+    Así los endpoints de píxeles (y sus cachés) nunca ven un .dcm a medio escribir,
+    aunque el proceso del SCP se interrumpa durante el C-STORE.
+    """
+    directory, filename = os.path.split(filepath)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{filename}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            ds.save_as(f, enforce_file_format=True)
+        os.replace(tmp_path, filepath) # Atómico dentro del mismo sistema de ficheros
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def handle_store(event):
     """
     Manejador para el evento C-STORE (evt.EVT_C_STORE) del SCP.
@@ -68,7 +91,7 @@ def handle_store(event):
         filename = ds.SOPInstanceUID + ".dcm"
         filepath = os.path.join(config.DICOM_RECEIVED_DIR, filename)
         
-        ds.save_as(filepath, enforce_file_format=True)
+        _save_atomically(ds, filepath)
         
         logger.info(f"Archivo DICOM recibido y guardado: {filepath}")
         return 0x0000 # Éxito
@@ -104,19 +127,36 @@ for context in AllStoragePresentationContexts:
     ae_scp.add_supported_context(context.abstract_syntax, ALL_TRANSFER_SYNTAXES)
 ae_scp.add_supported_context(Verification, ALL_TRANSFER_SYNTAXES)
 
+def _shutdown_gracefully(server, drain_timeout: float) -> None:
+    """
+    Deja de aceptar asociaciones, espera a que terminen las que están en curso
+    (como mucho `drain_timeout` segundos) y después apaga el AE.
+    """
+    server.shutdown() # Cierra el socket de escucha; las asociaciones activas siguen
+    deadline = time.monotonic() + drain_timeout
+    while ae_scp.active_associations and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if ae_scp.active_associations:
+        logger.warning(f"Apagando el SCP con {len(ae_scp.active_associations)} asociaciones aún activas.")
+    ae_scp.shutdown()
+
 # CORRECCIÓN: La función ahora acepta un 'callback' opcional
-def start_scp_server(callback=None):
+def start_scp_server(callback=None, stop_event=None, drain_timeout=None):
     """
     Inicia el servidor DICOM C-STORE SCP (Service Class Provider).
 
     Esta función es bloqueante y está diseñada para ser ejecutada en un hilo
-    separado. Escucha en el host y puerto configurados para recibir
+    o proceso separado. Escucha en el host y puerto configurados para recibir
     imágenes DICOM.
 
     Args:
         callback: Una función opcional a la que se le pasará la instancia
                   del servidor AE una vez creada. Esto permite al hilo principal
                   controlar el servidor (ej. para apagarlo).
+        stop_event: Evento opcional (p. ej. multiprocessing.Event). Al activarse, el
+                    servidor se apaga de forma ordenada y la función retorna.
+        drain_timeout: Segundos de espera a los C-STORE en curso al apagar; por
+                       defecto config.SCP_SHUTDOWN_TIMEOUT.
     """
     host = "0.0.0.0"
     port = config.API_SCP_PORT
@@ -129,7 +169,13 @@ def start_scp_server(callback=None):
         callback(ae_scp)
     
     try:
-        ae_scp.start_server((host, port), block=True, evt_handlers=handlers)
+        if stop_event is None:
+            ae_scp.start_server((host, port), block=True, evt_handlers=handlers)
+        else:
+            server = ae_scp.start_server((host, port), block=False, evt_handlers=handlers)
+            stop_event.wait()
+            logger.info("Apagado solicitado: esperando a los C-STORE en curso...")
+            _shutdown_gracefully(server, config.SCP_SHUTDOWN_TIMEOUT if drain_timeout is None else drain_timeout)
     except Exception as e:
         logger.error(f"Error fatal al iniciar o durante la ejecución del servidor SCP: {e}", exc_info=True)
     finally: